@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+
+# File: benchmark.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Benchmarks for developers. Run with '-h' as option for usage.
+
+Times the hot paths on the XEPs given with --xeps (or the xml files in the
+current directory), or on a generated synthetic corpus with --synthetic N.
+Results can be saved as JSON with --save and compared against an earlier
+run with --baseline; the exit status is 1 when a benchmark got slower than
+the baseline by more than --tolerance.
+"""
+
+import sys
+import os
+import copy
+import json
+import time
+import glob
+import base64
+import random
+import shutil
+import datetime
+import tempfile
+import platform
+import subprocess
+
+try:
+    import xeputils
+except ImportError:
+    # hack to import relative to this script, but don't mess with
+    # the path when not needed
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import xeputils
+
+STATUSES = ["Experimental", "Experimental", "Experimental", "Proposed",
+            "Draft", "Final", "Deferred", "Active", "Rejected", "Retracted",
+            "Obsolete", "Deprecated"]
+TYPES = ["Standards Track", "Informational", "Historical", "Procedural",
+         "Humorous"]
+
+XEPTEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<!DOCTYPE xep SYSTEM 'xep.dtd' [
+  <!ENTITY % ents SYSTEM 'xep.ent'>
+%ents;
+]>
+<?xml-stylesheet type='text/xsl' href='xep.xsl'?>
+<xep>
+<header>
+  <title>{title}</title>
+  <abstract>This specification defines synthetic protocol number {nr}.</abstract>
+  &LEGALNOTICE;
+  <number>{nr:04d}</number>
+  <status>{status}</status>{lastcall}{interim}
+  <type>{type}</type>
+  <sig>Standards</sig>
+  <approver>Council</approver>
+  <dependencies>{dependencies}</dependencies>
+  <supersedes/>
+  <supersededby/>
+  <shortname>{shortname}</shortname>
+  <author>
+    <firstname>Test</firstname>
+    <surname>Author</surname>
+    <email>test@example.invalid</email>
+    <jid>test@example.invalid</jid>
+  </author>
+{revisions}</header>
+{body}</xep>
+"""
+
+REVISIONTEMPLATE = """  <revision>
+    <version>{version}</version>
+    <date>{date}</date>
+    <initials>ta</initials>
+    <remark><p>Revision {version}.</p></remark>
+  </revision>
+"""
+
+SECTIONTEMPLATE = """<section1 topic='Section {no}' anchor='sect-{no}'>
+  <p>Lorem ipsum dolor sit amet &amp; consectetur, see &lt;http://example.com/{no}&gt; and <link url='#sect-1'>the introduction</link>.</p>
+  <example caption='Example {no}'><![CDATA[<iq type='get' id='{no}'><query xmlns='urn:xmpp:test:{no}'/></iq>]]></example>
+{image}</section1>
+"""
+
+# A 1x1 PNG, repeated to get a larger inline image
+PNG = ("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwAD"
+       "hgGAWjR9awAAAABJRU5ErkJggg==")
+
+
+def isInstalled(program):
+    """
+    Utility function, returns True when an executable program with the
+    given name is in the PATH.
+
+    Arguments:
+      program (str):    The name of the program, e.g. 'git'.
+    """
+    for path in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        fle = os.path.join(path, program)
+        if os.path.isfile(fle) and os.access(fle, os.X_OK):
+            return True
+    return False
+
+
+def generateXEP(nr, rnd):
+    """
+    Returns the XML of a synthetic XEP.
+
+    Arguments:
+      nr (int):         The number of the XEP.
+      rnd (Random):     The random generator to use.
+    """
+    status = rnd.choice(STATUSES)
+    revisions = rnd.randint(1, 30)
+    date = datetime.date(2002, 1, 1) + datetime.timedelta(days=rnd.randint(0, 8000))
+    interim = rnd.random() < 0.05
+    lastcall = rnd.random() < 0.1
+    major = rnd.choice([0, 1])
+    revs = []
+    for minor in range(revisions, 0, -1):
+        revs.append(REVISIONTEMPLATE.format(
+            version="{0}.{1}{2}".format(
+                major, minor, "rc1" if interim and minor == revisions else ""),
+            date=(date - datetime.timedelta(days=30 * (revisions - minor))).isoformat()))
+    sections = []
+    for no in range(1, rnd.choice([2, 5, 10, 40, 200]) + 1):
+        image = ""
+        if rnd.random() < 0.02:
+            image = "  <p><img src='data:image/png;base64,{}'/></p>\n".format(
+                PNG * rnd.randint(1, 500))
+        sections.append(SECTIONTEMPLATE.format(no=no, image=image))
+    return XEPTEMPLATE.format(
+        title="Synthetic XEP {}".format(nr),
+        nr=nr,
+        status=status,
+        lastcall="\n  <lastcall>{}</lastcall>".format(
+            (date + datetime.timedelta(days=14)).isoformat()) if lastcall else "",
+        interim="\n  <interim/>" if interim else "",
+        type=rnd.choice(TYPES),
+        dependencies="".join(
+            "<spec>XEP-{:04d}</spec>".format(rnd.randint(1, nr))
+            for i in range(rnd.randint(0, 4))),
+        shortname=rnd.choice(["N/A", "synthetic{}".format(nr), ""]),
+        revisions="".join(revs),
+        body="".join(sections))
+
+
+def generateCorpus(path, count, seed=0):
+    """
+    Generates a synthetic corpus of XEPs, with a DTD and entities to parse
+    them, committed in a new git repository (when git is installed), so the
+    git lookups are measured too. Returns the filenames of the XEPs.
+
+    Arguments:
+      path (str):   The directory to generate the corpus in.
+      count (int):  The number of XEPs.
+      seed (int):   The seed of the random generator, the same seed gives
+                    the same corpus.
+    """
+    rnd = random.Random(seed)
+    f = open(os.path.join(path, "xep.ent"), "w")
+    f.write("<!ENTITY LEGALNOTICE '<legal><p>Synthetic.</p></legal>'>\n")
+    f.write("<!ENTITY nbsp '&#160;'>\n")
+    f.close()
+    open(os.path.join(path, "xep.dtd"), "w").close()
+    files = []
+    for nr in range(1, count + 1):
+        fle = os.path.join(path, "xep-{:04d}.xml".format(nr))
+        f = open(fle, "w")
+        f.write(generateXEP(nr, rnd))
+        f.close()
+        files.append(fle)
+    if isInstalled("git"):
+        for cmd in (["init", "-q"],
+                    ["add", "."],
+                    ["-c", "user.name=benchmark",
+                     "-c", "user.email=benchmark@example.invalid",
+                     "commit", "-q", "-m", "Synthetic corpus"]):
+            subprocess.check_call(["git"] + cmd, cwd=path)
+    return files
+
+
+class ProcessCounter(object):
+
+    """
+    Counts the child processes started with subprocess.Popen, per command.
+    Use as context manager:
+        with ProcessCounter() as counter:
+            ...
+        print counter.counts
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def __enter__(self):
+        self.popen = subprocess.Popen
+        counts = self.counts
+        popen = self.popen
+
+        def countingPopen(args, *pargs, **kwargs):
+            cmd = " ".join(args[:2])
+            counts[cmd] = counts.get(cmd, 0) + 1
+            return popen(args, *pargs, **kwargs)
+        subprocess.Popen = countingPopen
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.Popen = self.popen
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def withOptions(config, **options):
+    """
+    Returns a copy of the configuration with some options changed.
+    """
+    config = copy.copy(config)
+    config._argdict = dict(config._argdict, **options)
+    return config
+
+
+class Suite(object):
+
+    """
+    Runs the benchmarks and keeps the results.
+
+    Attributes:
+      repeat (int):     Number of times to run each benchmark.
+      results (dict):   Per benchmark: the minimum and median time, the
+                        number of child processes started.
+    """
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, name, func, setup=None):
+        """
+        Times func, repeat times, after calling setup (untimed) each time.
+        """
+        times = []
+        with ProcessCounter() as counter:
+            for i in range(self.repeat):
+                if setup:
+                    setup()
+                start = time.time()
+                func()
+                times.append(time.time() - start)
+        times.sort()
+        self.results[name] = {"min": times[0],
+                              "median": times[len(times) // 2],
+                              "processes": counter.total() // self.repeat}
+        print "{:<32} min {:>8.4f}s  median {:>8.4f}s  {} child processes".format(
+            name, times[0], times[len(times) // 2], counter.total() // self.repeat)
+
+
+def runSuite(config, files, repeat):
+    """
+    Runs all benchmarks on the XEPs in files. Returns the results.
+    """
+    suite = Suite(repeat)
+    outpath = tempfile.mkdtemp(prefix='XEPbench_')
+    config = withOptions(config, xeps=files, outpath=outpath, jobs=1)
+    try:
+        xeputils.xep.gitTopLevels.clear()
+        suite.run("XEP.readXEP",
+                  lambda: [xeputils.xep.XEP(fle) for fle in files])
+        suite.run("XEP.readXEP (fullparse)",
+                  lambda: [xeputils.xep.XEP(fle, fullparse=True) for fle in files])
+        suite.run("AllXEPs.__init__ (no cache)",
+                  lambda: xeputils.repository.AllXEPs(
+                      withOptions(config, nocache=True)))
+        # fills the cache
+        xeps = xeputils.repository.AllXEPs(config)
+        suite.run("AllXEPs.__init__ (cached)",
+                  lambda: xeputils.repository.AllXEPs(config))
+        suite.run("AllXEPs.getExpired", xeps.getExpired)
+
+        def resetGit():
+            xeputils.xep.gitTopLevels.clear()
+            xeps.gitstatus.refresh()
+        # without the shared snapshot every XEP runs its own git status
+        unshared = [copy.copy(x) for x in xeps.xeps]
+        for x in unshared:
+            x.gitstatus = None
+        suite.run("XEP.isGitClean (snapshot)",
+                  lambda: [x.isGitClean() for x in xeps.xeps], resetGit)
+        suite.run("XEP.isGitClean (per XEP)",
+                  lambda: [x.isGitClean() for x in unshared], resetGit)
+        numbered = [x for x in xeps.xeps if isinstance(x.nr, (int, long))]
+
+        def updateXEPs():
+            t = xeputils.xeptable.XEPTable()
+            for x in numbered:
+                t.updateXEP(x)
+        suite.run("XEPTable.updateXEP", updateXEPs)
+        xmlfile = os.path.join(outpath, "xeps.xml")
+        htmlfile = os.path.join(outpath, "xeplist.txt")
+        suite.run("AllXEPs.buildTables",
+                  lambda: xeps.buildTables(xmlfile, htmlfile))
+        suite.run("XEPTable.writeHTMLTable",
+                  lambda: xeputils.xeptable.XEPTable(xmlfile).writeHTMLTable(htmlfile))
+        for x in xeps.xeps:
+            f = open(os.path.join(outpath, "xep-{}.pdf".format(x.nrFormatted)), "wb")
+            f.write("%PDF-1.4\n" + os.urandom(20000))
+            f.close()
+        suite.run("AllXEPs.buildBundle", xeps.buildBundle)
+        if config.xslpath and isInstalled("xsltproc"):
+            sample = xeps.xeps[:20]
+            suite.run("builder.buildXHTML ({} XEPs)".format(len(sample)),
+                      lambda: [x.buildXHTML(outpath, config.xslpath) for x in sample])
+        else:
+            print "skipping the XSLT stages, they need --xslpath and xsltproc"
+    finally:
+        shutil.rmtree(outpath)
+    return suite.results
+
+
+def runScaling(config, files, repeat, sizes):
+    """
+    Times AllXEPs.buildTables for growing numbers of XEPs, made by numbering
+    copies of the XEPs in files, and prints the time per XEP, which stays
+    flat when buildTables scales linearly. Returns the results.
+    """
+    suite = Suite(repeat)
+    outpath = tempfile.mkdtemp(prefix='XEPbench_')
+    config = withOptions(config, xeps=files, outpath=outpath, jobs=1, nocache=True)
+    try:
+        xeps = xeputils.repository.AllXEPs(config)
+        numbered = [x for x in xeps.xeps if isinstance(x.nr, (int, long))]
+        clones = []
+        for nr in range(1, max(sizes) + 1):
+            x = copy.copy(numbered[nr % len(numbered)])
+            x.nr = nr
+            x.nrFormatted = "{:0>4d}".format(nr)
+            clones.append(x)
+        xmlfile = os.path.join(outpath, "xeps.xml")
+        htmlfile = os.path.join(outpath, "xeplist.txt")
+        for size in sorted(sizes):
+            xeps.xeps = clones[:size]
+            name = "AllXEPs.buildTables ({} XEPs)".format(size)
+            suite.run(name, lambda: xeps.buildTables(xmlfile, htmlfile))
+        smallest = min(sizes)
+        base = suite.results["AllXEPs.buildTables ({} XEPs)".format(smallest)]["median"] / smallest
+        for size in sorted(sizes):
+            median = suite.results["AllXEPs.buildTables ({} XEPs)".format(size)]["median"]
+            print "{:>6} XEPs  {:>8.1f}us per XEP  {:.2f}x the per XEP time of {} XEPs".format(
+                size, median / size * 1e6, median / size / base, smallest)
+    finally:
+        shutil.rmtree(outpath)
+    return suite.results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results with a baseline, prints the regressions and returns
+    True if there are any.
+    """
+    regressions = False
+    for (name, result) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result["median"] / max(baseline[name]["median"], 1e-6)
+        if ratio > 1 + tolerance:
+            regressions = True
+            print "REGRESSION {:<32} {:.2f}x slower than the baseline".format(name, ratio)
+        elif ratio < 1 - tolerance:
+            print "improved   {:<32} {:.2f}x faster than the baseline".format(name, 1 / ratio)
+    return regressions
+
+
+config = xeputils.config.Config(parse=False)
+config._parser.add_argument("--repeat", metavar="N", type=int, default=3,
+                            help="Number of times to run each benchmark.")
+config._parser.add_argument("--synthetic", metavar="N", type=int,
+                            help="Benchmark on a generated corpus of N synthetic XEPs.")
+config._parser.add_argument("--seed", metavar="N", type=int, default=0,
+                            help="Seed for generating the synthetic corpus.")
+config._parser.add_argument("--save", metavar="FILE",
+                            help="Save the results as JSON to FILE.")
+config._parser.add_argument("--baseline", metavar="FILE",
+                            help="Compare the results with the results saved in FILE.")
+config._parser.add_argument("--tolerance", metavar="FRACTION", type=float, default=0.2,
+                            help="Slowdown compared to the baseline that counts as a regression. Defaults to 0.2.")
+config._parser.add_argument("--scaling", metavar="N", type=int, nargs="+",
+                            help="Only time AllXEPs.buildTables on copies of the XEPs numbered up to each N, e.g. '--scaling 1250 2500 5000 10000'.")
+config._parse()
+
+corpus = None
+if config.synthetic:
+    corpus = tempfile.mkdtemp(prefix='XEPcorpus_')
+    files = generateCorpus(corpus, config.synthetic, config.seed)
+elif config.xeps:
+    files = [os.path.abspath(fle) for fle in config.xeps if os.path.isfile(fle)]
+else:
+    files = sorted(glob.glob(os.path.join(os.getcwd(), '*.xml')))
+
+try:
+    if config.scaling:
+        results = runScaling(config, files, config.repeat, config.scaling)
+    else:
+        results = runSuite(config, files, config.repeat)
+finally:
+    if corpus:
+        shutil.rmtree(corpus)
+
+if config.save:
+    f = open(config.save, "w")
+    json.dump({"xeps": len(files),
+               "synthetic": config.synthetic,
+               "seed": config.seed,
+               "python": platform.python_version(),
+               "date": datetime.datetime.now().isoformat(),
+               "results": results}, f, indent=1, sort_keys=True)
+    f.close()
+
+if config.baseline:
+    f = open(config.baseline)
+    baseline = json.load(f)
+    f.close()
+    if baseline["xeps"] != len(files):
+        print "WARNING: the baseline was run on {} XEPs, this run on {}".format(
+            baseline["xeps"], len(files))
+    if compare(results, baseline["results"], config.tolerance):
+        sys.exit(1)
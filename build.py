@@ -55,3 +55,5 @@ config = xeputils.config.Config()
 xeps = xeputils.repository.AllXEPs(config)
 xeps.buildAll(showprogress=config.debug)
 xeps.processErrors()
+if config.watch:
+    xeputils.watch.XEPWatcher(xeps).run(showprogress=config.debug)
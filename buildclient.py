@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# File: buildclient.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Sends a request to the build server (see buildserver.py). Meant for hooks:
+it does not load xeputils, so it starts fast. Run with '-h' as option for
+usage.
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+
+# Same default as xeputils.server.SOCKET
+SOCKET = os.path.join(tempfile.gettempdir(), "xepbuildserver.sock")
+
+parser = argparse.ArgumentParser(
+    description="Send a request to the XEP build server.")
+parser.add_argument("action", choices=["build", "defer", "tables", "status", "stop"],
+                    help="'build' rebuilds XEPs and the index tables, 'defer' defers XEPs, 'tables' rebuilds the index tables, 'status' shows the queue and 'stop' stops the server.")
+parser.add_argument("xeps", metavar="XEP", nargs="*",
+                    help="Filenames or numbers (in the format of '0001') of the XEPs. Building without XEPs builds all XEPs.")
+parser.add_argument("--socket", metavar="PATH", default=SOCKET,
+                    help="Unix socket of the build server, defaults to {}.".format(SOCKET))
+parser.add_argument("-w", "--wait", action='store_true',
+                    help="Wait until the request is processed and print the errors.")
+args = parser.parse_args()
+
+# the server has a different working directory
+xeps = [os.path.abspath(x) if os.path.isfile(x) else x for x in args.xeps]
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+try:
+    s.connect(args.socket)
+    s.sendall(json.dumps(
+        {"action": args.action, "xeps": xeps, "wait": args.wait}) + "\n")
+    response = json.loads(s.makefile().readline())
+except (socket.error, ValueError) as e:
+    print "Could not reach the build server on {}: {}".format(args.socket, e)
+    sys.exit(1)
+finally:
+    s.close()
+
+if response.get("errors"):
+    print response["errors"]
+if args.action == "status":
+    print "{xeps} XEPs loaded, {queued} requests queued".format(**response)
+    for (action, xep) in response["busy"]:
+        print "Busy with: {} {}".format(action, xep or "all XEPs")
+elif response["status"] != "error" and not response.get("errors"):
+    print response["status"].capitalize()
+sys.exit(1 if response["status"] == "error" else 0)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# File: buildserver.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Runs a build server that keeps the XEPs loaded and builds them on request,
+see buildclient.py. Run with '-h' as option for usage.
+"""
+
+import sys
+import os
+
+# TODO move xeputils into it's own PyPI project
+try:
+    import xeputils
+except ImportError:
+    # hack to import relative to this script, but don't mess with
+    # the path when nog needed
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import xeputils
+
+config = xeputils.config.Config()
+
+xeps = xeputils.repository.AllXEPs(config)
+xeps.processErrors()
+xeputils.server.BuildServer(xeps, config.socket).run()
@@ -54,15 +54,14 @@ config = xeputils.config.Config()
 # read the XEPs
 xeps = xeputils.repository.AllXEPs(config)
 
-# Defer expired XEPs
-for x in xeps.getExpired():
-    x.defer()
-    if config.sendmail:
-        m = xeputils.mail.Deferred(config, x)
-        m.send()
-    if xeps.xeptable:
-        x.updateTable(xeps.xeptable,
-                      os.path.join(xeps.outpath, "xeplist.txt"))
+# Defer expired XEPs, the index tables are written once at the end
+with xeps.tableBatch() as tables:
+    for x in xeps.getExpired():
+        x.defer()
+        if config.sendmail:
+            m = xeputils.mail.Deferred(config, x)
+            m.send()
+        tables.updateXEP(x)
 
 # Make sure we report errors properly
 xeps.processErrors()
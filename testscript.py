@@ -36,6 +36,12 @@
 
 import sys
 import os
+import tempfile
+import shutil
+import subprocess
+import threading
+import BaseHTTPServer
+import SimpleHTTPServer
 
 try:
     import xeputils
@@ -63,6 +69,18 @@ if 1:
     for i in a.getExpired():
         print i, i.date
         i.pprint()
+if 0:
+    print "Comparing the metadata index with the parsed XEPs:"
+    index = xeputils.index.MetadataIndex(a.outpath)
+    print "updated: {}".format(index.update([x.filename for x in a.xeps], a.xeps))
+    for (name, idle) in (("getInterim", None), ("getNoShortName", None),
+                         ("getLastCall", None), ("getExpired", 365),
+                         ("getWithImages", None), ("getParseErrors", None)):
+        args = (idle,) if idle else ()
+        indexed = [str(x) for x in getattr(index, name)(*args)]
+        parsed = [str(x) for x in sorted(getattr(a, name)(*args))]
+        print "{:<16} {}".format(name, "ok" if indexed == parsed else (indexed, parsed))
+    index.close()
 if 0:
     print "With images:"
     for i in a.getWithImages():
@@ -77,6 +95,103 @@ if 0:
     if a.getExpired():
         x = a.getExpired()[0]
         x.defer()
+if 0:
+    print "Reverting interims in a generated git repository:"
+    template = """<?xml version='1.0' encoding='UTF-8'?>
+<!DOCTYPE xep SYSTEM 'xep.dtd' [
+  <!ENTITY % ents SYSTEM 'xep.ent'>
+%ents;
+]>
+<xep>
+<header>
+  <title>Test</title>
+  <abstract>Test XEP</abstract>
+  <number>0999</number>
+  <status>Experimental</status>
+  <type>Standards Track</type>
+  {interim}
+  <revision>
+    <version>{version}</version>
+    <date>2014-09-23</date>
+    <initials>test</initials>
+    <remark><p>Test</p></remark>
+  </revision>
+</header>
+<section1 topic='Test'><p>Test</p></section1>
+</xep>
+"""
+    repo = tempfile.mkdtemp(prefix='XEPtest_')
+    fle = os.path.join(repo, "xep-0999.xml")
+    subprocess.check_call(["git", "init", "-q"], cwd=repo)
+    for (version, interim) in (("0.1", ""), ("0.2", ""),
+                               ("0.2rc1", "<interim/>"),
+                               ("0.2rc2", "<interim/>")):
+        f = open(fle, "w")
+        f.write(template.format(version=version, interim=interim))
+        f.close()
+        for cmd in (["git", "add", "xep-0999.xml"],
+                    ["git", "-c", "user.name=test", "-c", "user.email=test@example.invalid",
+                     "commit", "-q", "-m", version]):
+            subprocess.check_call(cmd, cwd=repo)
+    i = xeputils.xep.XEP(fle)
+    i.revertInterim()
+    print "reverted to {} (expected 0.2), errors: {}".format(i.version, i.buildErrors)
+    # the last non-interim version only exists as a merge with a conflict
+    # resolution, the interim on the merged branch doesn't count
+    git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.invalid"]
+
+    def commit(version, interim):
+        f = open(fle, "w")
+        f.write(template.format(version=version, interim=interim))
+        f.close()
+        subprocess.check_call(["git", "add", "xep-0999.xml"], cwd=repo)
+        subprocess.check_call(git + ["commit", "-q", "-m", version], cwd=repo)
+    subprocess.check_call(["git", "checkout", "-q", "-b", "side", "HEAD~2"], cwd=repo)
+    commit("0.3rc1", "<interim/>")
+    subprocess.check_call(["git", "checkout", "-q", "-"], cwd=repo)
+    commit("0.2.1", "")
+    subprocess.call(git + ["merge", "-q", "side"], cwd=repo,
+                    stdout=open(os.devnull, "w"))
+    commit("0.3", "")
+    commit("0.4rc1", "<interim/>")
+    i = xeputils.xep.XEP(fle)
+    i.revertInterim()
+    print "reverted to {} (expected 0.3), errors: {}".format(i.version, i.buildErrors)
+    shutil.rmtree(repo)
+if 0:
+    print "Rewriting the TeX source generated by texml"
+    rawtex = ('\\section{Intro}\n'
+              'See  http://xmpp.org/extensions/ and (http://example.com/a#b).\n'
+              '\\href{http://xmpp.org/rfcs/rfc6120.html#bind}{RFC 6120}\n'
+              '\\href{#sect-1}{Section \\hyperref[#sect-1]{1}}\n'
+              '\\hyperref[#sect-idp1]{Section 1} on page \\pageref{#sect-idp1}\n'
+              '"http://not.rewritten" and \\# escaped\n')
+    golden = ('\\section{Intro}\n'
+              'See \\path{ http://xmpp.org/extensions/} and \\path{(http://example.com/a#b).}\n'
+              '\\href{http://xmpp.org/rfcs/rfc6120.html\\#bind}{RFC 6120}\n'
+              '\\href{\\#sect-1}{Section \\hyperref[sect-1]{1}}\n'
+              '\\hyperref[sect-idp1]{Section 1} on page \\pageref{sect-idp1}\n'
+              '"http://not.rewritten" and \\# escaped\n')
+    result = xeputils.builder.rewriteTeX(rawtex)
+    print "golden file matches: {}".format(result == golden)
+if 0:
+    print "Fetching remote images from a local http server"
+    docroot = tempfile.mkdtemp(prefix='XEPtest_')
+    f = open(os.path.join(docroot, "image.png"), "wb")
+    f.write("not really a png")
+    f.close()
+    os.chdir(docroot)
+    server = BaseHTTPServer.HTTPServer(
+        ("127.0.0.1", 0), SimpleHTTPServer.SimpleHTTPRequestHandler)
+    threading.Thread(target=server.serve_forever).start()
+    base = "http://127.0.0.1:{}/".format(server.server_port)
+    remote = xeputils.remoteimages.ImageCache(docroot, timeout=5)
+    print "errors: {} (expected the missing image)".format(
+        remote.prefetch([base + "image.png", base + "missing.png"]))
+    print "cached: {}".format(remote.get(base + "image.png"))
+    print "revalidated: {} (expected None)".format(remote.fetch(base + "image.png"))
+    server.shutdown()
+    shutil.rmtree(docroot)
 if 0:
     print "Building all"
     a.buildAll(showprogress=True)
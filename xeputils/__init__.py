@@ -37,11 +37,24 @@ Utility functions for handling XEPs.
 """
 
 import builder
+import cache
 import config
+import gitrepo
+import images
+import index
 import mail
+import manifest
+import remoteimages
 import repository
+import server
+import stagecache
+import texformat
+import trace
+import watch
+import workspace
 import xep
 import xeptable
+import xslt
 
 # metadata:
 __authors__ = ["Winfried Tilanus <winfried@tilanus.com>"]
@@ -35,7 +35,8 @@
 """
 Functions for building XHTML and PDF files from XEPs. These have some
 dependencies:
- xsltproc (executable binary, debian package xsltproc)
+ xsltproc (executable binary, debian package xsltproc) or lxml (python
+   module, debian package python-lxml), see xeputils.xslt
  texml (python module, for source see: http://getfo.org)
  xelatex (executable binary, debian package texlive-xetex)
    Aditionally xelatex needs some dependencies:
@@ -52,49 +53,267 @@ dependencies:
 import os
 import StringIO
 import shutil
-import tempfile
 import subprocess
-import base64
 import urlparse
-import urllib
 import re
+import hashlib
 import Texml.processor
 import xeputils.repository
+import xeputils.images
+import xeputils.xslt
+import xeputils.workspace
+import xeputils.texformat
+import xeputils.stagecache
+import xeputils.remoteimages
+import xeputils.trace
 
+# Build dependencies, relative to the xslpath
+XHTMLDEPS = ["xep.ent", "xep.dtd", "xep.xsl", "ref.xsl", "examples.xsl"]
+PDFDEPS = ["xep.ent", "xep.dtd", "xep2texml.xsl",
+           "deps/adjcalc.sty",
+           "deps/collectbox.sty", "deps/tc-dvips.def", "deps/tc-pgf.def",
+           "deps/trimclip.sty", "deps/adjustbox.sty", "deps/tabu.sty",
+           "deps/tc-pdftex.def", "deps/tc-xetex.def"]
+# The part of the PDFDEPS the tex.xml depends on
+TEXXMLDEPS = ["xep.ent", "xep.dtd", "xep2texml.xsl"]
+# Images needed for the PDFs, relative to the imagespath
+PDFIMAGES = ["xmpp.pdf", "xmpp-text.pdf"]
 
-def buildXHTML(xep, outpath=None, xslpath=None):
+# Files xelatex reads back in the next pass, if these didn't change during a
+# pass the output has converged
+AUXEXTS = [".aux", ".toc", ".out"]
+# Warnings in the xelatex log asking for another pass
+RERUN = re.compile(
+    r"Rerun to get|Rerun LaTeX|Please rerun|Label\(s\) may have changed")
+# Maximum number of xelatex passes, when not configured
+MAXPASSES = 3
+
+# Rewrites of the TeX source generated by texml, see rewriteTeX
+TEXREFS = re.compile(
+    r'\\href{([^#}]*)#([^}]*)}|\\hyperref\[#([^\]]*)\]|\\pageref{#([^}]*)}')
+TEXREWRITES = re.compile(
+    r'([\s"])([^"]http://[^ \r\n"]*)|' + TEXREFS.pattern)
+
+# The workspace used when none is given, see getWorkspace
+defaultWorkspace = None
+
+
+def getXSLPath(xep, xslpath=None):
     """
-    Generates a nice formatted XHTML file from the XEP.
+    Returns the path where the xsl stylesheets and the other build
+    dependencies of the XEP can be found.
 
     Arguments:
-      outpath (str):    The full path were the tree of the generated XEPs should
-                        be build. When unspecified, a temporary directory in the
-                        systems default temporary file location is used.
       xslpath (str):    The path where the xsl stylesheets can be found. When
                         not specified a directory based on the xep file location
                         is guessed.
     """
-    outpath = xeputils.repository.prepDir(outpath)
-    temppath = tempfile.mkdtemp(prefix='XEPbuilder_')
     if not xslpath:
         if os.path.basename(xep.path) == 'inbox':
             xslpath = os.path.abspath(os.path.join(xep.path, ".."))
         else:
             xslpath = xep.path
+    return xslpath
+
+
+def getImagesPath(imagespath=None):
+    """
+    Returns the full path where the images needed for building the PDFs can
+    be found.
+
+    Arguments:
+      imagespath (str): The path where the images can be found, defaults to
+                        '../images/'.
+    """
+    if imagespath is None:
+        imagespath = "../images/"
+    return os.path.abspath(os.path.join(imagespath))
+
+
+def getWorkspace(workspace=None):
+    """
+    Returns the workspace to build in: the given one or else one that is
+    shared by all builds in this process. The shared workspace copies the
+    build dependencies again when they changed, see Workspace.stage.
+
+    Arguments:
+      workspace (Workspace): The workspace to use, if any.
+    """
+    global defaultWorkspace
+    if workspace:
+        return workspace
+    if not defaultWorkspace:
+        defaultWorkspace = xeputils.workspace.Workspace()
+    return defaultWorkspace
+
+
+def stageXHTML(workspace, xep, xslpath=None):
+    """
+    Stages the dependencies for building the XHTML of a XEP in the workspace
+    and returns the list of shared directories.
+
+    Arguments:
+      workspace (Workspace): The workspace.
+      xslpath (str):    The path where the xsl stylesheets can be found.
+    """
+    return [workspace.stage(getXSLPath(xep, xslpath), XHTMLDEPS)]
+
+
+def stagePDF(workspace, xep, xslpath=None, imagespath=None):
+    """
+    Stages the dependencies for building the PDF of a XEP in the workspace
+    and returns the list of shared directories.
+
+    Arguments:
+      workspace (Workspace): The workspace.
+      xslpath (str):    The path where the xsl stylesheets can be found.
+      imagespath (str): The path where the images can be found.
+    """
+    return [workspace.stage(getXSLPath(xep, xslpath), PDFDEPS),
+            workspace.stage(getImagesPath(imagespath), PDFIMAGES)]
+
+
+def rewriteRef(match):
+    """
+    Utility function, returns the replacement of a href, hyperref or pageref
+    matched by TEXREFS.
+    """
+    (href, anchor, hyperref, pageref) = match.groups()[-4:]
+    if href is not None:
+        # escape the pound sign in the href
+        return "\\href{{{0}\\#{1}}}".format(
+            href, TEXREFS.sub(rewriteRef, anchor))
+    # adjust references, strip the leading pound sign.
+    if hyperref is not None:
+        return "\\hyperref[{}]".format(hyperref)
+    return "\\pageref{{{}}}".format(pageref)
+
+
+def rewriteURL(match):
+    """
+    Utility function, returns the replacement of a url or a reference
+    matched by TEXREWRITES.
+    """
+    (space, url) = match.group(1, 2)
+    if url is None:
+        return rewriteRef(match)
+    # make the url breakable, references in it are rewritten too
+    return "{0}\\path{{{1}}}".format(space, TEXREFS.sub(rewriteRef, url))
+
+
+def rewriteTeX(rawtex):
+    r"""
+    Returns the TeX source generated by texml with http urls in free text
+    made breakable and the pound signs in hrefs, hyperrefs and pagerefs
+    escaped or stripped, in a single pass. For texml output (where #, { and
+    } in text are escaped) this equals the substitutions:
+      ([\s"])([^"]http://[^ \r\n"]*)  ->  \1\\path{\2}
+      \\href{([^#}]*)#([^}]*)}        ->  \\href{\1\#\2}
+      \\hyperref\[#([^\]]*)\]         ->  \\hyperref[\1]
+      \\pageref{#([^}]*)}             ->  \\pageref{\1}
+    applied one after the other.
+
+    Arguments:
+      rawtex (str): The TeX source.
+    """
+    # The url regex should match all urls in free text; not the urls in
+    # xml:ns or so..so no " or ' in front.
+    # ToDo: check this regex, it may make some mismatches.
+    return TEXREWRITES.sub(rewriteURL, rawtex)
+
+
+def auxHash(temppath, xep):
+    """
+    Returns a hash of the auxiliary files xelatex generated for the XEP.
+
+    Arguments:
+      temppath (str):   The directory xelatex runs in.
+    """
+    h = hashlib.sha1()
+    for ext in AUXEXTS:
+        filename = os.path.join(
+            temppath, "xep-{0}{1}".format(xep.nrFormatted, ext))
+        if os.path.isfile(filename):
+            f = open(filename, "rb")
+            h.update(ext)
+            h.update(f.read())
+            f.close()
+    return h.hexdigest()
+
+
+def needsRerun(temppath, xep):
+    """
+    Returns True if the xelatex log of the XEP asks for another pass.
+
+    Arguments:
+      temppath (str):   The directory xelatex runs in.
+    """
+    try:
+        f = open(os.path.join(temppath, "xep-{}.log".format(xep.nrFormatted)))
+        log = f.read()
+        f.close()
+    except IOError:
+        return True
+    return RERUN.search(log) is not None
+
+
+def runXelatex(xep, temppath, args, maxpasses=None):
+    """
+    Runs xelatex until the TOC and references stop changing and xelatex
+    doesn't ask for a rerun anymore, with a maximum of maxpasses. Returns
+    the build errors.
+
+    Arguments:
+      temppath (str):   The directory to run xelatex in.
+      args (list):      The arguments for xelatex.
+      maxpasses (int):  The maximum number of passes, defaults to MAXPASSES.
+    """
+    errors = []
+    aux = auxHash(temppath, xep)
+    for i in range(maxpasses or MAXPASSES):
+        with xeputils.trace.Span("xelatex", "xelatex", xep) as span:
+            span.args["pass"] = i
+            p = subprocess.Popen(["xelatex", "-interaction=batchmode"] + args,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 cwd=temppath)
+            (out, error) = p.communicate()
+            span.status(p.returncode)
+        if error:
+            errors.append(
+                "Error while generating PDF for {0}: {1} (pass {2})".format(str(xep), error, i))
+        (previous, aux) = (aux, auxHash(temppath, xep))
+        if aux == previous and not needsRerun(temppath, xep):
+            break
+    return errors
+
+
+def buildXHTML(xep, outpath=None, xslpath=None, workspace=None):
+    """
+    Generates a nice formatted XHTML file from the XEP. Inline images are
+    saved in the image store of the outpath and linked from the XHTML.
 
-    for fle in ["xep.ent", "xep.dtd", "xep.xsl", "ref.xsl", "examples.xsl"]:
-        shutil.copy(os.path.join(xslpath, fle), temppath)
+    Arguments:
+      outpath (str):    The full path were the tree of the generated XEPs should
+                        be build. When unspecified, a temporary directory in the
+                        systems default temporary file location is used.
+      xslpath (str):    The path where the xsl stylesheets can be found. When
+                        not specified a directory based on the xep file location
+                        is guessed.
+      workspace (Workspace): The workspace to build in. When unspecified, a
+                        workspace shared by all builds in this process is used.
+    """
+    outpath = xeputils.repository.prepDir(outpath)
+    workspace = getWorkspace(workspace)
+    temppath = workspace.job(*stageXHTML(workspace, xep, xslpath))
+    xslpath = getXSLPath(xep, xslpath)
 
     # XHTML
+    store = xeputils.images.ImageStore(outpath)
     outfile = open(
         os.path.join(outpath, "xep-{}.html".format(xep.nrFormatted)), "w")
-    xsl = os.path.join(temppath, "xep.xsl")
-    p = subprocess.Popen(["xsltproc", xsl, "-"],
-                         stdin=subprocess.PIPE,
-                         stdout=outfile,
-                         stderr=subprocess.PIPE,
-                         cwd=temppath)
-    (dummy, error) = p.communicate(xep.raw)
+    error = xeputils.xslt.transform(
+        "xep.xsl", xep, xslpath, temppath, outfile, store=store)
     outfile.close()
     if error:
         xep.buildErrors.append(
@@ -105,13 +324,8 @@ def buildXHTML(xep, outpath=None, xslpath=None):
         os.makedirs(os.path.join(outpath, "refs"))
     outfile = open(
         os.path.join(outpath, "refs", "reference.XSF.XEP-{}.xml".format(xep.nrFormatted)), "w")
-    xsl = os.path.join(temppath, "ref.xsl")
-    p = subprocess.Popen(["xsltproc", xsl, "-"],
-                         stdin=subprocess.PIPE,
-                         stdout=outfile,
-                         stderr=subprocess.PIPE,
-                         cwd=temppath)
-    (dummy, error) = p.communicate(xep.raw)
+    error = xeputils.xslt.transform(
+        "ref.xsl", xep, xslpath, temppath, outfile)
     outfile.close()
     if error:
         xep.buildErrors.append(
@@ -122,13 +336,8 @@ def buildXHTML(xep, outpath=None, xslpath=None):
         os.makedirs(os.path.join(outpath, "examples"))
     outfile = open(
         os.path.join(outpath, "examples", "{}.xml".format(xep.nrFormatted)), "w")
-    xsl = os.path.join(temppath, "examples.xsl")
-    p = subprocess.Popen(["xsltproc", xsl, "-"],
-                         stdin=subprocess.PIPE,
-                         stdout=outfile,
-                         stderr=subprocess.PIPE,
-                         cwd=temppath)
-    (dummy, error) = p.communicate(xep.raw)
+    error = xeputils.xslt.transform(
+        "examples.xsl", xep, xslpath, temppath, outfile)
     outfile.close()
     if error:
         xep.buildErrors.append(
@@ -144,129 +353,207 @@ def buildXHTML(xep, outpath=None, xslpath=None):
     shutil.rmtree(temppath)
 
 
-def buildPDF(xep, outpath=None, xslpath=None, imagespath=None):
+def makeTeX(xep, xslpath, temppath, stagecache=None):
     """
-    Generates a nice formatted PDF file from the XEP.
+    Generates the TeX source of the XEP and writes it to xep-NNNN.tex in
+    temppath. The tex.xml goes straight from the stylesheet into texml.
+    Returns the TeX source.
+
     Arguments:
-      outpath (str):    The full path were the tree of the generated XEPs should
-                        be build. When unspecified, a temporary directory in the
-                        systems default temporary file location is used.
-      xslpath (str):    The path where the xsl stylesheets can be found. When
-                        not specified a directory based on the xep file location
-                        is guessed.
+      xslpath (str):    The path where the xsl stylesheets can be found.
+      temppath (str):   The directory to build in.
+      stagecache (StageCache): The cache to take the tex.xml and TeX from
+                        and to store them in, if any.
     """
-    outpath = xeputils.repository.prepDir(outpath)
-    temppath = tempfile.mkdtemp(prefix='XEPbuilder_')
-    if imagespath is None:
-        imagespath = "../images/"
-    imagespath = os.path.abspath(os.path.join(imagespath))
-    if not xslpath:
-        if os.path.basename(xep.path) == 'inbox':
-            xslpath = os.path.abspath(os.path.join(xep.path, ".."))
+    texfile = os.path.join(temppath, "xep-{}.tex".format(xep.nrFormatted))
+    texxml = None
+    rawtex = None
+    if stagecache:
+        texxmlkey = stagecache.key(
+            [xep.raw, xeputils.xslt.engine],
+            [os.path.join(temppath, fle) for fle in TEXXMLDEPS])
+        texxml = stagecache.get(xep, "texxml", texxmlkey)
+        if texxml is not None:
+            texkey = stagecache.key([texxml])
+            rawtex = stagecache.get(xep, "tex", texkey)
+
+    if rawtex is None:
+        outfile = StringIO.StringIO()
+        texmlErrors = []
+        recorders = []
+
+        def texml(stream):
+            if stagecache:
+                stream = xeputils.stagecache.Recorder(stream)
+                recorders.append(stream)
+            try:
+                with xeputils.trace.Span("texml", "texml", xep):
+                    Texml.processor.process(
+                        in_stream=stream, out_stream=outfile, encoding="UTF-8")
+            except Exception as msg:
+                texmlErrors.append(msg)
+        errors = len(xep.buildErrors)
+        if texxml is None:
+            error = xeputils.xslt.stream(
+                "xep2texml.xsl", xep, xslpath, temppath, texml)
+            if error:
+                xep.buildErrors.append(
+                    "Error while generating tex.xml for {0}: {1}".format(str(xep), error))
+            elif stagecache:
+                texxml = recorders[0].getvalue()
+                stagecache.put(xep, "texxml", texxmlkey, texxml)
         else:
-            xslpath = xep.path
+            texml(StringIO.StringIO(texxml))
+        for msg in texmlErrors:
+            xep.buildErrors.append(
+                "Error while converting xml to tex for {0}: {1}".format(str(xep), msg))
+        rawtex = rewriteTeX(outfile.getvalue())
+        outfile.close()
+        if stagecache and len(xep.buildErrors) == errors:
+            stagecache.put(xep, "tex", stagecache.key([texxml]), rawtex)
+
+    f = open(texfile, "w")
+    f.write(rawtex)
+    f.close()
+    return rawtex
 
-    for fle in ["xep.ent", "xep.dtd", "xep2texml.xsl", 
-                os.path.join(imagespath, "xmpp.pdf"),
-                os.path.join(imagespath, "xmpp-text.pdf"),
-                "deps/adjcalc.sty",
-                "deps/collectbox.sty", "deps/tc-dvips.def", "deps/tc-pgf.def",
-                "deps/trimclip.sty", "deps/adjustbox.sty", "deps/tabu.sty",
-                "deps/tc-pdftex.def", "deps/tc-xetex.def"]:
-        shutil.copy(os.path.join(xslpath, fle), temppath)
-
-    # save inline images in tempdir
-    for (no, img) in enumerate(xep.images):
-        up = urlparse.urlparse(img)
-        if up.scheme == 'data':
-            head, data = up.path.split(',')
-            # Tobias suggested to do something sensible with charset, mimetype
-            # and encoding. I love the idea, but something tells me we will only
-            # see these:
-            if not head in ['image/png;base64', 'image/jpeg;base64']:
-                raise Exception(
-                    "Unknown encoding for inline image in {0}: {1}".format(str(xep), head))
-            plaindata = base64.b64decode(data)
-            mimetype = head.split(';')[0]
-            fileext = mimetype.split('/')[1]
-            imgfilename = os.path.join(
-                temppath, 'inlineimage-{0}-{1:d}.{2}'.format(xep.nrFormatted, no, fileext))
-            f = open(imgfilename, 'wb')
-            f.write(plaindata)
-            f.close()
-        elif up.scheme in ['http', 'https']:
-            request = urllib.urlopen(img)
-            filename, fileext = os.path.splitext(up.path)
-            if not fileext:
-                fileext = ".{}".format(request.info().getsubtype())
-            imgfilename = os.path.join(
-                temppath, 'inlineimage-{0}-{1:d}{2}'.format(xep.nrFormatted, no, fileext))
-            f = open(imgfilename, 'wb')
-            f.write(request.read())
-            f.close()
-            request.close()
 
-    texxmlfile = os.path.join(
-        temppath, "xep-{}.tex.xml".format(xep.nrFormatted))
+def makePDF(xep, rawtex, outpath, temppath, maxpasses=None, texformat=False,
+            stagecache=None, pdfkey=None):
+    """
+    Runs xelatex on xep-NNNN.tex in temppath, from the precompiled format of
+    the preamble when possible.
+
+    Arguments:
+      rawtex (str):     The TeX source.
+      outpath (str):    The path the XEPs are build in.
+      temppath (str):   The directory to build in.
+      maxpasses (int):  The maximum number of xelatex passes.
+      texformat (bool): Start xelatex from a precompiled format.
+      stagecache (StageCache): The cache to store the PDF and the auxiliary
+                        files in, if any. The auxiliary files of the previous
+                        build are used as a starting point, often saving a
+                        pass.
+      pdfkey (str):     The key of the inputs of the PDF in the stage cache.
+    """
     texfile = os.path.join(temppath, "xep-{}.tex".format(xep.nrFormatted))
+    pdffile = os.path.join(temppath, "xep-{}.pdf".format(xep.nrFormatted))
+    auxfiles = [os.path.join(temppath, "xep-{0}{1}".format(xep.nrFormatted, ext))
+                for ext in AUXEXTS]
+    if stagecache:
+        for (ext, auxfile) in zip(AUXEXTS, auxfiles):
+            aux = stagecache.latest(xep, ext[1:])
+            if aux is not None:
+                f = open(auxfile, "wb")
+                f.write(aux)
+                f.close()
 
-    # prepare for texml processing
-    outfile = open(texxmlfile, "w")
-    xsl = os.path.join(temppath, "xep2texml.xsl")
-    p = subprocess.Popen(["xsltproc", xsl, "-"],
-                         stdin=subprocess.PIPE,
-                         stdout=outfile,
-                         stderr=subprocess.PIPE,
-                         cwd=temppath)
-    (dummy, error) = p.communicate(xep.raw)
-    outfile.close()
-    if error:
-        xep.buildErrors.append(
-            "Error while generating tex.xml for {0}: {1}".format(str(xep), error))
+    errors = None
+    if texformat:
+        args = xeputils.texformat.FormatStore(outpath).prepare(
+            xep, rawtex, temppath, PDFDEPS)
+        if args:
+            errors = runXelatex(xep, temppath, args, maxpasses)
+            if not os.path.isfile(pdffile):
+                # fall back to building without the format, from scratch
+                errors = None
+                for auxfile in auxfiles:
+                    if os.path.isfile(auxfile):
+                        os.remove(auxfile)
+    if errors is None:
+        errors = runXelatex(xep, temppath, [texfile], maxpasses)
+    xep.buildErrors.extend(errors)
 
-    # Create TeX
-    outfile = StringIO.StringIO()
-    try:
-        Texml.processor.process(
-            in_stream=texxmlfile, out_stream=outfile, encoding="UTF-8")
-    except Exception as msg:
-        xep.buildErrors.append(
-            "Error while converting xml to tex for {0}: {1}".format(str(xep), msg))
-    finally:
-        rawtex = outfile.getvalue()
-        outfile.close()
+    if stagecache and not errors and os.path.isfile(pdffile):
+        for (ext, auxfile) in zip(AUXEXTS, auxfiles) + [(".pdf", pdffile)]:
+            if os.path.isfile(auxfile):
+                f = open(auxfile, "rb")
+                stagecache.put(xep, ext[1:], pdfkey, f.read())
+                f.close()
 
-    # detect http urls and escape them to make them breakable
-    # this should match all urls in free text; not the urls in xml:ns or so..so no " or ' in front.
-    # ToDo: check this regex, it may make some mismatches.
-    rawtex = re.sub(r'([\s"])([^"]http://[^ \r\n"]*)', r'\1\\path{\2}', rawtex)
-    # and escape the pond sign in the href
-    rawtex = re.sub(r'\\href{([^#}]*)#([^}]*)}', r'\\href{\1\#\2}', rawtex)
 
-    # adjust references, strip the leading pound sign.
-    rawtex = re.sub(r'\\hyperref\[#([^\]]*)\]', r'\\hyperref[\1]', rawtex)
-    rawtex = re.sub(r'\\pageref{#([^}]*)}', r'\\pageref{\1}', rawtex)
+def buildPDF(xep, outpath=None, xslpath=None, imagespath=None, workspace=None,
+             maxpasses=None, texformat=False, stagecache=None):
+    """
+    Generates a nice formatted PDF file from the XEP.
+    Arguments:
+      outpath (str):    The full path were the tree of the generated XEPs should
+                        be build. When unspecified, a temporary directory in the
+                        systems default temporary file location is used.
+      xslpath (str):    The path where the xsl stylesheets can be found. When
+                        not specified a directory based on the xep file location
+                        is guessed.
+      imagespath (str): The path where the images can be found, defaults to
+                        '../images/'.
+      workspace (Workspace): The workspace to build in. When unspecified, a
+                        workspace shared by all builds in this process is used.
+      maxpasses (int):  The maximum number of xelatex passes, defaults to
+                        MAXPASSES.
+      texformat (bool): Start xelatex from a precompiled format of the
+                        preamble, see xeputils.texformat. Falls back to a
+                        normal build when that fails.
+      stagecache (StageCache): Cache of the intermediate artifacts, stages of
+                        which the inputs are in the cache are skipped. See
+                        xeputils.stagecache.
+    """
+    outpath = xeputils.repository.prepDir(outpath)
+    workspace = getWorkspace(workspace)
+    temppath = workspace.job(
+        *stagePDF(workspace, xep, xslpath, imagespath))
+    xslpath = getXSLPath(xep, xslpath)
 
-    f = open(texfile, "w")
-    f.write(rawtex)
-    f.close()
+    # save inline images in tempdir, they are decoded into the image store,
+    # remote images come from the remote image cache
+    store = xeputils.images.ImageStore(outpath)
+    remote = xeputils.remoteimages.ImageCache(outpath)
+    with xeputils.trace.Span("images", "images", xep):
+        for (no, img) in enumerate(xep.images):
+            up = urlparse.urlparse(img)
+            if up.scheme == 'data':
+                name = store.extract(img)
+                if not name:
+                    head = up.path.split(',')[0]
+                    raise Exception(
+                        "Unknown encoding for inline image in {0}: {1}".format(str(xep), head))
+                fileext = os.path.splitext(name)[1]
+                imgfilename = os.path.join(
+                    temppath, 'inlineimage-{0}-{1:d}{2}'.format(xep.nrFormatted, no, fileext))
+                shutil.copy(os.path.join(store.path, name), imgfilename)
+            elif xeputils.remoteimages.isRemote(img):
+                # prefetched by AllXEPs.prefetchImages or XEP.buildPDF
+                cached = remote.get(img)
+                if cached is None:
+                    xep.buildErrors.append(
+                        "Error while fetching image for {0}: {1} is not in the remote image cache".format(str(xep), img))
+                    continue
+                (filename, fileext) = cached
+                imgfilename = os.path.join(
+                    temppath, 'inlineimage-{0}-{1:d}{2}'.format(xep.nrFormatted, no, fileext))
+                shutil.copy(filename, imgfilename)
 
-    # Build PDF
-    # Do this multiple times, to build TOC and references
-    for i in range(2):
-        p = subprocess.Popen(["xelatex", "-interaction=batchmode", texfile],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             cwd=temppath)
-        (out, error) = p.communicate()
-        if error:
-            xep.buildErrors.append(
-                "Error while generating PDF for {0}: {1} (pass {2})".format(str(xep), error, i))
+    # Create TeX and build the PDF, each stage is skipped when its inputs
+    # are in the stage cache
+    rawtex = makeTeX(xep, xslpath, temppath, stagecache)
+    pdffile = os.path.join(temppath, "xep-{}.pdf".format(xep.nrFormatted))
+    pdfkey = None
+    if stagecache:
+        # the TeX dependencies and (inline) images, not the stylesheet
+        pdfkey = stagecache.key(
+            [rawtex, str(maxpasses or MAXPASSES)],
+            [os.path.join(temppath, fle) for fle in sorted(os.listdir(temppath))
+             if fle not in TEXXMLDEPS and not fle.startswith("xep-")])
+        pdf = stagecache.get(xep, "pdf", pdfkey)
+        if pdf is not None:
+            f = open(pdffile, "wb")
+            f.write(pdf)
+            f.close()
+    if not os.path.isfile(pdffile):
+        makePDF(xep, rawtex, outpath, temppath, maxpasses, texformat,
+                stagecache, pdfkey)
 
     # move the PDF out of the way and clean up
     try:
-        shutil.copy(
-            os.path.join(temppath, "xep-{}.pdf".format(xep.nrFormatted)), outpath)
+        shutil.copy(pdffile, outpath)
     except IOError:
         xep.buildErrors.append(
             "FATAL: Generating PDF for {} failed.".format(str(xep)))
@@ -0,0 +1,168 @@
+# File: cache.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+On-disk cache of the metadata parsed from XEPs, so unchanged XEPs don't have
+to be parsed again on every run.
+"""
+
+import os
+import fcntl
+import hashlib
+import tempfile
+import cPickle as pickle
+
+
+class MetadataCache(object):
+
+    """
+    Cache of the metadata of parsed XEPs, stored as a pickle in the file
+    CACHEFILE. The entries are keyed by the full filename of the XEP and only
+    used when the size and the hash of the contents of the file did not
+    change. The modification time is recorded as well, for reference.
+
+    The cache file is replaced atomically and updates are merged with the
+    cache on disk while holding a lock, so concurrent runs (e.g. a cronjob
+    and a manual build) don't corrupt or overwrite each others updates.
+    A cache written by a different VERSION is ignored.
+
+    Attributes:
+        filename (str):     Full filename of the cache.
+        entries (dict):     The cached entries, {filename: entry}
+        updated (dict):     The entries added during this run.
+    """
+    CACHEFILE = ".xepcache.pickle"
+    VERSION = 2
+
+    def __init__(self, path):
+        """
+        Reads the cache in path, starts with an empty cache if there is none
+        or if it can't be read.
+
+        Arguments:
+          path (str):   The directory to keep the cache in.
+        """
+        self.path = path
+        self.filename = os.path.join(path, self.CACHEFILE)
+        self.entries = self.read()
+        self.updated = {}
+
+    def read(self):
+        """
+        Returns the entries of the cache on disk, or an empty dictionary when
+        there is no usable cache.
+        """
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                data = pickle.load(f)
+            finally:
+                f.close()
+            if data["version"] == self.VERSION:
+                return data["entries"]
+        except Exception:
+            # missing, truncated or otherwise unusable, start over
+            pass
+        return {}
+
+    def fileKey(self, filename, raw):
+        """
+        Returns the properties of the file the cached entry is validated with:
+        the size and hash of the content, and the modification time.
+        """
+        return {"size": len(raw),
+                "sha1": hashlib.sha1(raw).hexdigest(),
+                "mtime": os.path.getmtime(filename)}
+
+    def get(self, filename, raw):
+        """
+        Returns the cached metadata of a XEP file, or None when the file is
+        not in the cache or changed since it was cached.
+
+        Arguments:
+          filename (str):   Full filename of the XEP.
+          raw (str):        The current contents of the file.
+        """
+        entry = self.entries.get(filename)
+        if not entry:
+            return None
+        if entry["size"] != len(raw):
+            return None
+        if entry["sha1"] != hashlib.sha1(raw).hexdigest():
+            return None
+        return entry["meta"]
+
+    def put(self, filename, raw, meta):
+        """
+        Adds the metadata of a XEP file to the cache.
+
+        Arguments:
+          filename (str):   Full filename of the XEP.
+          raw (str):        The contents of the file the metadata is read from.
+          meta (dict):      The metadata.
+        """
+        entry = self.fileKey(filename, raw)
+        entry["meta"] = meta
+        self.entries[filename] = entry
+        self.updated[filename] = entry
+
+    def save(self):
+        """
+        Merges the entries added during this run into the cache on disk.
+        Entries of files that don't exist anymore are dropped.
+        """
+        if not self.updated:
+            return
+        lock = open(self.filename + ".lock", 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.read()
+            entries.update(self.updated)
+            for filename in entries.keys():
+                if not os.path.isfile(filename):
+                    del entries[filename]
+            (fd, tmpname) = tempfile.mkstemp(
+                prefix=self.CACHEFILE, dir=self.path)
+            f = os.fdopen(fd, 'wb')
+            pickle.dump({"version": self.VERSION, "entries": entries},
+                        f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            # mkstemp creates the file private, but other users may share it
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, self.filename)
+            self.entries = entries
+            self.updated = {}
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
@@ -86,6 +86,8 @@ class Config(object):
         "logtostdout": True,
         "mailserver": "localhost",
         "imagespath": "../images/",
+        "jobs": 1,
+        "xslt": "xsltproc",
     }
 
     def __init__(self, parse=True):
@@ -143,6 +145,19 @@ class Config(object):
         --outpath / -o
         --xslpath
         --imagespath
+        --jobs [N] / -j [N]
+        --rebuild
+        --cachepath
+        --nocache
+        --index
+        --xslt [ENGINE]
+        --workpath
+        --maxpasses [N]
+        --texformat
+        --timeout [SECONDS]
+        --trace [FILE]
+        --watch
+        --socket [PATH]
         """
         self._parser.add_argument("-h", "--help", action='store_true',
                                   help="Print this help.")
@@ -170,6 +185,32 @@ class Config(object):
                                   help="Specify path where to look for the XSL stylesheets and the other build dependencies when building the XEP.")
         self._parser.add_argument("--imagespath", metavar="PATH",
                                   help="Specify path where to look for the images to include when building the XEP.")
+        self._parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                                  help="Number of jobs to run in parallel when parsing and building XEPs. Defaults to 1.")
+        self._parser.add_argument("--rebuild", action='store_true',
+                                  help="Ignore the build manifest in the outpath and rebuild all XEPs, even when they did not change.")
+        self._parser.add_argument("--cachepath", metavar="PATH",
+                                  help="Specify directory to cache the metadata parsed from the XEPs in. Defaults to the outpath.")
+        self._parser.add_argument("--nocache", action='store_true',
+                                  help="Do not use the metadata cache, parse all XEPs.")
+        self._parser.add_argument("--index", action='store_true',
+                                  help="Keep a SQLite index of the metadata of the XEPs in the cachepath, to query the XEPs without reading them.")
+        self._parser.add_argument("--workpath", metavar="PATH",
+                                  help="Specify directory to create the temporary build workspace in, e.g. on a tmpfs. Defaults to the systems temporary directory.")
+        self._parser.add_argument("--maxpasses", metavar="N", type=int,
+                                  help="Maximum number of xelatex passes when building a PDF, xelatex is run until the references converged. Defaults to 3.")
+        self._parser.add_argument("--texformat", action='store_true',
+                                  help="Dump the preamble of the PDFs in a precompiled TeX format and start xelatex from that format. Falls back to a normal build when that fails.")
+        self._parser.add_argument("--timeout", metavar="SECONDS", type=int,
+                                  help="Seconds to wait for a server when fetching the remote images of the XEPs. Defaults to 30.")
+        self._parser.add_argument("--trace", metavar="FILE",
+                                  help="Save a Chrome trace (JSON) of the time spent in every build stage to FILE and print a summary of the slowest stages and XEPs.")
+        self._parser.add_argument("--watch", action='store_true',
+                                  help="Keep running after the build and rebuild when the XEPs or the stylesheets change: a changed XEP rebuilds that XEP and the index tables, a changed stylesheet rebuilds all XEPs. Uses inotify when pyinotify is installed, polls otherwise.")
+        self._parser.add_argument("--socket", metavar="PATH",
+                                  help="Unix socket the build server listens on and buildclient.py connects to. Defaults to xepbuildserver.sock in the systems temporary directory.")
+        self._parser.add_argument("--xslt", metavar="ENGINE", choices=["xsltproc", "lxml"],
+                                  help="XSLT engine to use when building XEPs: 'xsltproc' (default) or 'lxml', which compiles each stylesheet only once and parses each XEP only once for all stylesheets.")
 
     def _parse(self):
         """
@@ -0,0 +1,242 @@
+# File: gitrepo.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Utilities for reading the state of the git repositories the XEPs are in with
+as few git processes as possible.
+"""
+
+import os
+import subprocess
+
+
+class GitStatus(object):
+
+    """
+    Snapshot of the 'git status' of the git repositories the XEPs are in. The
+    status of a repository is read with a single 'git status --porcelain -z'
+    on first use and kept until it is refreshed, e.g. after committing.
+
+    Attributes:
+        snapshots (dict):   The status per toplevel, as tuples (dirty, error),
+                                dirty being a set of paths (relative to the
+                                toplevel) that are changed or untracked and
+                                error the error git reported, if any.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def read(self, toplevel):
+        """
+        Returns the status of the repository as a tuple (dirty, error), reads
+        it from git when there is no snapshot yet.
+
+        Arguments:
+          toplevel (str):   The toplevel of the git repository.
+        """
+        if toplevel not in self.snapshots:
+            p = subprocess.Popen(
+                ["git", "status", "--porcelain", "-z"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=toplevel)
+            (out, error) = p.communicate()
+            dirty = set()
+            if not error:
+                entries = out.split('\0')
+                while entries:
+                    entry = entries.pop(0)
+                    if not entry:
+                        continue
+                    dirty.add(entry[3:])
+                    if entry[0] in "RC":
+                        # renames and copies are followed by the original path
+                        dirty.add(entries.pop(0))
+            self.snapshots[toplevel] = (dirty, error)
+        return self.snapshots[toplevel]
+
+    def refresh(self, toplevel=None):
+        """
+        Drops the snapshot of a repository, or of all repositories when no
+        toplevel is given, so the status is read again on the next use.
+        """
+        if toplevel is None:
+            self.snapshots = {}
+        else:
+            self.snapshots.pop(toplevel, None)
+
+    def markClean(self, filename, toplevel):
+        """
+        Updates the snapshot of a repository after a file has been committed,
+        without running git again.
+
+        Arguments:
+          filename (str):   Full filename of the committed file.
+          toplevel (str):   The toplevel of the git repository it is in.
+        """
+        if toplevel in self.snapshots:
+            self.snapshots[toplevel][0].discard(
+                os.path.relpath(filename, toplevel))
+
+    def isClean(self, filename, toplevel):
+        """
+        Checks if a file is clean in git, returns a tuple (clean, error).
+        Files in untracked directories are not clean.
+
+        Arguments:
+          filename (str):   Full filename of the file to check.
+          toplevel (str):   The toplevel of the git repository it is in.
+        """
+        (dirty, error) = self.read(toplevel)
+        if error:
+            return (False, error)
+        gitref = os.path.relpath(filename, toplevel)
+        if gitref in dirty:
+            return (False, None)
+        for path in dirty:
+            # untracked directories are listed as a whole
+            if path.endswith('/') and gitref.startswith(path):
+                return (False, None)
+        return (True, None)
+
+
+class GitHistory(object):
+
+    """
+    Index of the commits that changed each file of a git repository, built
+    with a single 'git log --name-only', and a persistent
+    'git cat-file --batch' process to read old versions of the files. Call
+    close() when done, to stop the cat-file process.
+
+    Attributes:
+        toplevel (str):     The toplevel of the git repository.
+        paths (list):       Full filenames to restrict the index to, all files
+                                are indexed when None.
+        commits (dict):     The commits per path (relative to the toplevel),
+                                newest first, None when not indexed yet.
+        error (str):        The error git reported while indexing, if any.
+    """
+
+    def __init__(self, toplevel, paths=None):
+        """
+        Arguments:
+          toplevel (str):   The toplevel of the git repository.
+          paths (list):     Optional list with full filenames to restrict the
+                            index to.
+        """
+        self.toplevel = toplevel
+        self.paths = paths
+        self.commits = None
+        self.error = None
+        self.catfile = None
+
+    def index(self):
+        """
+        Reads the history of the repository with a single git log. Only the
+        first parents of merges are followed, and merges list the files they
+        changed compared to their first parent, so changes that were merged
+        (e.g. with a conflict resolution) are indexed too.
+        """
+        cmd = ["git", "-c", "core.quotepath=off", "log", "--first-parent",
+               "-m", "--pretty=format:%x01%H", "--name-only"]
+        if self.paths:
+            cmd.append("--")
+            cmd += [os.path.relpath(path, self.toplevel) for path in self.paths]
+        p = subprocess.Popen(cmd,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             cwd=self.toplevel)
+        (out, error) = p.communicate()
+        self.commits = {}
+        self.error = error
+        commit = None
+        for line in out.splitlines():
+            if line.startswith('\x01'):
+                commit = line[1:]
+            elif line:
+                self.commits.setdefault(line, []).append(commit)
+
+    def getCommits(self, filename):
+        """
+        Returns a tuple (commits, error), commits being a list with the
+        commits that changed the file, newest first.
+
+        Arguments:
+          filename (str):   Full filename of the file.
+        """
+        if self.commits is None:
+            self.index()
+        gitref = os.path.relpath(filename, self.toplevel)
+        return (self.commits.get(gitref, []), self.error)
+
+    def getBlob(self, commit, filename):
+        """
+        Returns a tuple (blob, error), blob being the contents of the file at
+        the given commit, or None when it can't be read.
+
+        Arguments:
+          commit (str):     The hash of the commit.
+          filename (str):   Full filename of the file.
+        """
+        if self.catfile is None:
+            self.catfile = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=-1,
+                cwd=self.toplevel)
+        gitref = os.path.relpath(filename, self.toplevel)
+        self.catfile.stdin.write("{}:{}\n".format(commit, gitref))
+        self.catfile.stdin.flush()
+        header = self.catfile.stdout.readline()
+        if not header:
+            self.close()
+            return (None, "git cat-file stopped unexpectedly")
+        parts = header.split()
+        if len(parts) != 3 or parts[1] != "blob":
+            return (None, header.strip())
+        blob = self.catfile.stdout.read(int(parts[2]))
+        # every object is followed by a newline
+        self.catfile.stdout.read(1)
+        return (blob, None)
+
+    def close(self):
+        """
+        Stops the cat-file process, if running.
+        """
+        if self.catfile:
+            self.catfile.stdin.close()
+            self.catfile.wait()
+            self.catfile = None
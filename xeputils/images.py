@@ -0,0 +1,174 @@
+# File: images.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Content addressed storage of the inline (data: URL) images of XEPs, shared by
+the XHTML and the PDF builds.
+"""
+
+import os
+import re
+import base64
+import hashlib
+import tempfile
+import xml.parsers.expat
+
+# The encodings of inline images we know how to handle
+ENCODINGS = {'image/png;base64': 'png',
+             'image/jpeg;base64': 'jpeg'}
+
+# The start tag of an img element up to the opening quote of its src
+# attribute, skipping the other attributes (whose values may contain '>')
+IMGSRC = re.compile(
+    r"""<img(?:\s+[^\s=/>]+\s*=\s*(?:'[^']*'|"[^"]*"))*?\s+src\s*=\s*(['"])""")
+
+
+def findInlineImages(raw):
+    """
+    Utility function, parses the raw XML of a XEP and returns a list of
+    tuples (start, end, src) for the img elements with an inline image:
+    the offsets of the value of the src attribute in the raw XML and the
+    parsed value. Only real img elements are found, not img tags in
+    escaped text or CDATA sections (e.g. in examples). The external DTD and
+    entities are not loaded, just like with minidom.
+
+    Arguments:
+      raw (str):    The raw XML of the XEP.
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    found = []
+
+    def start(name, attrs):
+        if name == "img" and attrs.get("src", "").startswith("data:"):
+            offset = parser.CurrentByteIndex
+            match = IMGSRC.match(raw, offset)
+            if match:
+                end = raw.index(match.group(1), match.end())
+                found.append((match.end(), end, attrs["src"]))
+    parser.StartElementHandler = start
+    parser.Parse(raw, True)
+    return found
+
+
+class ImageStore(object):
+
+    """
+    Store of the inline images of XEPs in the STOREDIR directory of an
+    outpath. Each image is decoded once and saved under a name derived from
+    the hash of its data, so identical images in different XEPs (or in
+    subsequent builds) are stored and decoded only once.
+
+    Attributes:
+        path (str):     The full path of the store.
+    """
+    STOREDIR = "inlineimages"
+
+    def __init__(self, outpath):
+        """
+        Arguments:
+          outpath (str):    The path the XEPs are build in.
+        """
+        self.path = os.path.join(outpath, self.STOREDIR)
+
+    def extract(self, src):
+        """
+        Makes sure the inline image is in the store and returns its filename
+        (relative to the store). Returns None if src is not an inline image
+        with a known encoding.
+
+        Arguments:
+          src (str):    The src of the img tag, a data: URL
+        """
+        if not src.startswith("data:") or ',' not in src:
+            return None
+        head, data = src[5:].split(',', 1)
+        # Tobias suggested to do something sensible with charset, mimetype
+        # and encoding. I love the idea, but something tells me we will only
+        # see these:
+        if head not in ENCODINGS:
+            return None
+        data = "".join(data.split())
+        name = "{0}.{1}".format(hashlib.sha1(data).hexdigest(), ENCODINGS[head])
+        filename = os.path.join(self.path, name)
+        if not os.path.isfile(filename):
+            if not os.path.isdir(self.path):
+                try:
+                    os.makedirs(self.path)
+                except OSError:
+                    # created by a parallel build
+                    pass
+            # write and rename, so parallel builds never see half an image
+            (fd, tmpname) = tempfile.mkstemp(prefix=name, dir=self.path)
+            f = os.fdopen(fd, 'wb')
+            f.write(base64.b64decode(data))
+            f.close()
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        return name
+
+    def rewrite(self, raw):
+        """
+        Returns the raw XML of a XEP with the src of all inline images
+        replaced by a link to the image in the store, relative to the
+        outpath. Only the img elements of the parsed XML are rewritten, the
+        rest of the raw XML is left as is.
+
+        Arguments:
+          raw (str):    The raw XML of the XEP.
+        """
+        # only the values of the src attributes change, so the entity
+        # references in the XML are kept for the stylesheet
+        parts = []
+        done = 0
+        for (start, end, src) in findInlineImages(raw):
+            name = self.extract(src)
+            if name:
+                parts.append(raw[done:start])
+                parts.append("{0}/{1}".format(self.STOREDIR, name))
+                done = end
+        parts.append(raw[done:])
+        return "".join(parts)
+
+    def rewriteTree(self, tree):
+        """
+        Replaces the src of all inline images in a parsed (lxml) XML tree of
+        a XEP by a link to the image in the store, relative to the outpath.
+
+        Arguments:
+          tree (ElementTree):   The XML tree of the XEP, modified in place.
+        """
+        for img in tree.iter("img"):
+            name = self.extract(img.get("src", ""))
+            if name:
+                img.set("src", "{0}/{1}".format(self.STOREDIR, name))
@@ -0,0 +1,299 @@
+# File: index.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+SQLite index of the metadata of XEPs, kept up to date incrementally, so
+tools and cronjobs can select XEPs across runs without reading the sources.
+"""
+
+import os
+import sqlite3
+import hashlib
+import datetime
+import cPickle as pickle
+import xeputils.xep
+
+
+def isoDate(value):
+    """
+    Utility function, returns a date(time) as 'YYYY-MM-DD' for the index, or
+    None when there is no date (e.g. a XEP without last call).
+    """
+    if value:
+        return value.strftime("%Y-%m-%d")
+    return None
+
+
+class MetadataIndex(object):
+
+    """
+    Index of the metadata of XEPs in the SQLite database INDEXFILE. The
+    table 'xeps' has a row per XEP file with indexed columns for the number,
+    status, type, date and last call, and the full metadata (see
+    XEP.getMeta) to make XEP objects from. The table 'dependencies' has a
+    row per spec a XEP depends on.
+
+    A row is only updated when the modification time or the size of its file
+    changed and the hash of the contents differs, so keeping the index up to
+    date only parses the changed XEPs. An index written by a different
+    VERSION is thrown away.
+
+    Attributes:
+        filename (str):     Full filename of the database.
+        db (Connection):    The connection to the database.
+    """
+    INDEXFILE = ".xepindex.sqlite"
+    VERSION = 2
+    SCHEMA = """
+        CREATE TABLE xeps (
+            filename TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            sha1 TEXT,
+            number,
+            title TEXT,
+            status TEXT,
+            type TEXT,
+            date TEXT,
+            lastcall TEXT,
+            interim INTEGER,
+            shortname TEXT,
+            images INTEGER,
+            parseerrors INTEGER,
+            meta BLOB);
+        CREATE INDEX xeps_number ON xeps (number);
+        CREATE INDEX xeps_status ON xeps (status);
+        CREATE INDEX xeps_type ON xeps (type);
+        CREATE INDEX xeps_date ON xeps (date);
+        CREATE INDEX xeps_lastcall ON xeps (lastcall);
+        CREATE TABLE dependencies (
+            filename TEXT,
+            spec TEXT);
+        CREATE INDEX dependencies_filename ON dependencies (filename);
+        CREATE INDEX dependencies_spec ON dependencies (spec);
+        """
+
+    def __init__(self, path):
+        """
+        Opens the index in path, creates it when there is none.
+
+        Arguments:
+          path (str):   The directory to keep the index in.
+        """
+        self.path = path
+        self.filename = os.path.join(path, self.INDEXFILE)
+        self.db = sqlite3.connect(self.filename, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            with self.db:
+                self.db.execute("DROP TABLE IF EXISTS xeps")
+                self.db.execute("DROP TABLE IF EXISTS dependencies")
+            self.db.executescript(self.SCHEMA)
+            self.db.execute("PRAGMA user_version = {}".format(self.VERSION))
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self.db.close()
+
+    def update(self, files, xeps=()):
+        """
+        Brings the index up to date with the XEP files: adds new and changed
+        files and removes the rows of files that don't exist anymore. Returns
+        the number of added and changed files.
+
+        Arguments:
+          files (list):     Full filenames of the XEPs.
+          xeps (list):      XEP objects of (some of) the files that are
+                            parsed already, they are not parsed again.
+        """
+        loaded = dict((xep.filename, xep) for xep in xeps)
+        updated = 0
+        with self.db:
+            for fle in files:
+                try:
+                    st = os.stat(fle)
+                    row = self.db.execute(
+                        "SELECT mtime, size, sha1 FROM xeps WHERE filename = ?",
+                        (fle,)).fetchone()
+                    if row and (row["mtime"], row["size"]) == (st.st_mtime, st.st_size):
+                        continue
+                    f = open(fle, 'r')
+                    sha1 = hashlib.sha1(f.read()).hexdigest()
+                    f.close()
+                except (IOError, OSError):
+                    self.remove(fle)
+                    continue
+                if row and row["sha1"] == sha1:
+                    # touched, but not changed
+                    self.db.execute(
+                        "UPDATE xeps SET mtime = ?, size = ? WHERE filename = ?",
+                        (st.st_mtime, st.st_size, fle))
+                    continue
+                xep = loaded.get(fle)
+                if xep is None:
+                    try:
+                        xep = xeputils.xep.XEP(fle)
+                    except:
+                        # not a XEP (anymore), AllXEPs reports why
+                        self.remove(fle)
+                        continue
+                try:
+                    self.put(xep, st, sha1)
+                except sqlite3.Error:
+                    raise
+                except Exception:
+                    # e.g. a broken body found while scanning for images,
+                    # AllXEPs reports it when building the XEP
+                    self.remove(fle)
+                    continue
+                finally:
+                    # the images are scanned for again when needed
+                    xep.release()
+                updated += 1
+            for row in self.db.execute("SELECT filename FROM xeps").fetchall():
+                if not os.path.isfile(row["filename"]):
+                    self.remove(row["filename"])
+        return updated
+
+    def put(self, xep, st, sha1):
+        """
+        Adds or replaces the row of a XEP and its dependencies.
+
+        Arguments:
+          xep (XEP):        The XEP.
+          st (stat_result): The stat of the XEP file.
+          sha1 (str):       The hash of the contents of the file.
+        """
+        meta = xep.getMeta()
+        self.db.execute(
+            "INSERT OR REPLACE INTO xeps VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (xep.filename, st.st_mtime, st.st_size, sha1, xep.nr, xep.title,
+             xep.status, xep.type, isoDate(xep.date), isoDate(xep.lastcall),
+             int(bool(xep.interim)), xep.shortname, len(xep.images),
+             len(xep.parseErrors),
+             sqlite3.Binary(pickle.dumps(meta, pickle.HIGHEST_PROTOCOL))))
+        self.db.execute(
+            "DELETE FROM dependencies WHERE filename = ?", (xep.filename,))
+        self.db.executemany(
+            "INSERT INTO dependencies VALUES (?, ?)",
+            [(xep.filename, spec) for spec in xep.depends])
+
+    def remove(self, filename):
+        """
+        Removes the row of a XEP file and its dependencies.
+        """
+        self.db.execute("DELETE FROM xeps WHERE filename = ?", (filename,))
+        self.db.execute(
+            "DELETE FROM dependencies WHERE filename = ?", (filename,))
+
+    def select(self, where="1", params=(), order="number"):
+        """
+        Returns the XEPs for which an SQL condition on the 'xeps' table holds,
+        as XEP objects made from the indexed metadata. The XEP files are not
+        read.
+
+        Arguments:
+          where (str):      The condition, with '?' placeholders for the
+                            params.
+          params (tuple):   The values of the placeholders.
+          order (str):      The column(s) to sort on.
+        """
+        rows = self.db.execute(
+            "SELECT filename, meta FROM xeps WHERE {} ORDER BY {}".format(
+                where, order),
+            params)
+        return [xeputils.xep.XEP(row["filename"],
+                                 meta=pickle.loads(str(row["meta"])))
+                for row in rows]
+
+    def getByStatus(self, status):
+        """
+        Returns the XEPs with a status, e.g. 'Draft'.
+        """
+        return self.select("status = ?", (status,))
+
+    def getInterim(self):
+        """
+        Returns the XEPs with the status 'interim'.
+        """
+        return self.select("interim = 1")
+
+    def getLastCall(self):
+        """
+        Returns the XEPs that have a last call.
+        """
+        return self.select("lastcall IS NOT NULL")
+
+    def getExpired(self, idle=365):
+        """
+        Returns the experimental XEPs that have been idle for more then 'idle'
+        days.
+
+        Arguments:
+          idle (int): optional number of days before an experimental XEP expires
+                      defaults to 365 days
+        """
+        cutOff = datetime.datetime.now() - datetime.timedelta(days=idle)
+        # the dates are days, a XEP of the day of the cut off is expired
+        return self.select("status = 'Experimental' AND date <= ?",
+                           (isoDate(cutOff),))
+
+    def getNoShortName(self):
+        """
+        Returns the XEPs without a shortname.
+        """
+        return self.select("shortname IS NULL OR shortname = ''")
+
+    def getWithImages(self):
+        """
+        Returns the XEPs that have img tags.
+        """
+        return self.select("images > 0")
+
+    def getParseErrors(self):
+        """
+        Returns the XEPs that met errors while parsing.
+        """
+        return self.select("parseerrors > 0")
+
+    def getDependants(self, spec):
+        """
+        Returns the XEPs that depend on a spec, e.g. 'XEP-0030'.
+        """
+        return self.select(
+            "filename IN (SELECT filename FROM dependencies WHERE spec = ?)",
+            (spec,))
@@ -0,0 +1,197 @@
+# File: manifest.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Bookkeeping of the inputs of build XEPs, to skip building XEPs that didn't
+change since the previous build.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import xeputils.builder
+
+
+class BuildManifest(object):
+
+    """
+    The build manifest of an outpath. For every XEP and every build stage
+    ("xhtml" or "pdf") it records a hash of all inputs of that stage: the raw
+    XML of the XEP and the stylesheets, build dependencies and images that
+    get copied in while building. A stage of a XEP is up to date when the hash
+    of its current inputs equals the recorded hash and its outputs exist.
+
+    The manifest is stored as JSON in the file MANIFESTFILE in the outpath.
+
+    Attributes:
+        filename (str):     Full filename of the manifest.
+        entries (dict):     The recorded hashes, as {nrFormatted: {stage: hash}}
+        filehashes (dict):  Cache of the hashes of the dependency files, so
+                                each dependency is read only once per run.
+    """
+    MANIFESTFILE = ".buildmanifest.json"
+    VERSION = 1
+
+    def __init__(self, outpath):
+        """
+        Reads the build manifest of outpath, starts with an empty manifest if
+        there is none or if it can't be read.
+
+        Arguments:
+          outpath (str):    The path the XEPs are build in.
+        """
+        self.outpath = outpath
+        self.filename = os.path.join(outpath, self.MANIFESTFILE)
+        self.filehashes = {}
+        self.entries = {}
+        try:
+            f = open(self.filename, 'r')
+            data = json.load(f)
+            f.close()
+            if data.get("version") == self.VERSION:
+                self.entries = data["xeps"]
+        except (IOError, ValueError, KeyError, AttributeError):
+            # no usable manifest, everything will be build
+            self.entries = {}
+
+    def clear(self):
+        """
+        Forgets all recorded hashes, so all XEPs will be build.
+        """
+        self.entries = {}
+
+    def fileHash(self, filename):
+        """
+        Returns the (cached) hash of the contents of a file.
+        """
+        if filename not in self.filehashes:
+            h = hashlib.sha1()
+            try:
+                f = open(filename, 'rb')
+                h.update(f.read())
+                f.close()
+            except IOError:
+                h.update("missing")
+            self.filehashes[filename] = h.hexdigest()
+        return self.filehashes[filename]
+
+    def dependencies(self, xep, stage, xslpath=None, imagespath=None):
+        """
+        Returns a list with the full filenames of all files a build stage
+        depends on, besides the XEP itself.
+        """
+        xslpath = xeputils.builder.getXSLPath(xep, xslpath)
+        if stage == "xhtml":
+            return [os.path.join(xslpath, fle)
+                    for fle in xeputils.builder.XHTMLDEPS]
+        imagespath = xeputils.builder.getImagesPath(imagespath)
+        deps = [os.path.join(xslpath, fle)
+                for fle in xeputils.builder.PDFDEPS]
+        # new style or tex files in deps invalidate the PDFs too
+        deps += sorted(glob.glob(os.path.join(xslpath, "deps", "*.sty")))
+        deps += [os.path.join(imagespath, fle)
+                 for fle in xeputils.builder.PDFIMAGES]
+        return deps
+
+    def outputs(self, xep, stage):
+        """
+        Returns a list with the full filenames of all files a build stage
+        generates.
+        """
+        if stage == "xhtml":
+            return [
+                os.path.join(self.outpath,
+                             "xep-{}.html".format(xep.nrFormatted)),
+                os.path.join(self.outpath, "refs",
+                             "reference.XSF.XEP-{}.xml".format(xep.nrFormatted)),
+                os.path.join(self.outpath, "examples",
+                             "{}.xml".format(xep.nrFormatted)),
+                os.path.join(self.outpath,
+                             "xep-{}.xml".format(xep.nrFormatted))]
+        return [os.path.join(self.outpath, "xep-{}.pdf".format(xep.nrFormatted))]
+
+    def inputHash(self, xep, stage, xslpath=None, imagespath=None):
+        """
+        Returns the hash over all inputs of a build stage of a XEP.
+        """
+        h = hashlib.sha1()
+        h.update(stage)
+        h.update(hashlib.sha1(xep.raw).hexdigest())
+        for dep in self.dependencies(xep, stage, xslpath, imagespath):
+            h.update(dep)
+            h.update(self.fileHash(dep))
+        return h.hexdigest()
+
+    def isUpToDate(self, xep, stage, xslpath=None, imagespath=None):
+        """
+        Returns True when the build stage of the XEP does not need to be
+        build again.
+        """
+        recorded = self.entries.get(xep.nrFormatted, {}).get(stage)
+        if recorded != self.inputHash(xep, stage, xslpath, imagespath):
+            return False
+        for fle in self.outputs(xep, stage):
+            if not os.path.isfile(fle):
+                return False
+        return True
+
+    def update(self, xep, stage, xslpath=None, imagespath=None):
+        """
+        Records the current inputs of a build stage of a XEP, call after a
+        successful build.
+        """
+        self.entries.setdefault(xep.nrFormatted, {})[stage] = self.inputHash(
+            xep, stage, xslpath, imagespath)
+
+    def forget(self, xep, stage):
+        """
+        Removes the record of a build stage of a XEP, e.g. after a failed
+        build.
+        """
+        self.entries.get(xep.nrFormatted, {}).pop(stage, None)
+
+    def save(self):
+        """
+        Writes the manifest to disk. Writes to a temporary file first, so the
+        manifest is never left half written.
+        """
+        (fd, tmpname) = tempfile.mkstemp(
+            prefix=self.MANIFESTFILE, dir=self.outpath)
+        f = os.fdopen(fd, 'w')
+        json.dump({"version": self.VERSION, "xeps": self.entries},
+                  f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(tmpname, self.filename)
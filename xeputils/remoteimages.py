@@ -0,0 +1,212 @@
+# File: remoteimages.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+On disk cache of the remote (http and https) images of XEPs. The images are
+fetched concurrently before the PDFs are build and revalidated with the
+ETag and Last-Modified headers, so unchanged images are not downloaded
+again.
+"""
+
+import os
+import json
+import urllib2
+import urlparse
+import hashlib
+import tempfile
+import multiprocessing.pool
+
+# Number of images to fetch concurrently
+FETCHTHREADS = 8
+# Seconds to wait for a server, when not configured
+TIMEOUT = 30
+
+
+def isRemote(src):
+    """
+    Utility function, returns True if the src of an image is a http or https
+    URL.
+
+    Arguments:
+      src (str):    The src of the img tag.
+    """
+    return urlparse.urlparse(src).scheme in ('http', 'https')
+
+
+class ImageCache(object):
+
+    """
+    Cache of remote images in the STOREDIR directory of an outpath. Per image
+    the data and a JSON file with the headers needed for revalidation are
+    stored, both named after a hash of the URL.
+
+    Attributes:
+        path (str):     The full path of the cache.
+        timeout (int):  Seconds to wait for a server.
+    """
+    STOREDIR = ".remoteimages"
+
+    def __init__(self, outpath, timeout=None):
+        """
+        Arguments:
+          outpath (str):    The path the XEPs are build in.
+          timeout (int):    Seconds to wait for a server, defaults to TIMEOUT.
+        """
+        self.path = os.path.join(outpath, self.STOREDIR)
+        self.timeout = timeout or TIMEOUT
+
+    def filenames(self, url):
+        """
+        Returns a tuple with the filenames of the data and of the headers of
+        an image.
+
+        Arguments:
+          url (str):    The URL of the image.
+        """
+        name = os.path.join(self.path, hashlib.sha1(url).hexdigest())
+        return (name, name + ".json")
+
+    def headers(self, url):
+        """
+        Returns the stored headers of an image, or None when it is not in the
+        cache.
+
+        Arguments:
+          url (str):    The URL of the image.
+        """
+        (datafile, headerfile) = self.filenames(url)
+        if not os.path.isfile(datafile):
+            return None
+        try:
+            f = open(headerfile)
+            headers = json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            return None
+        return headers
+
+    def write(self, filename, data):
+        """
+        Writes a file in the cache, atomically.
+
+        Arguments:
+          filename (str):   The full filename.
+          data (str):       The content.
+        """
+        (fd, tmpname) = tempfile.mkstemp(
+            prefix=os.path.basename(filename), dir=self.path)
+        f = os.fdopen(fd, 'wb')
+        f.write(data)
+        f.close()
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+
+    def fetch(self, url):
+        """
+        Fetches an image into the cache, or revalidates the cached copy.
+        Returns None on success or an error message.
+
+        Arguments:
+          url (str):    The URL of the image.
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # created by a parallel build
+                pass
+        (datafile, headerfile) = self.filenames(url)
+        headers = self.headers(url)
+        request = urllib2.Request(url)
+        if headers:
+            if headers.get("etag"):
+                request.add_header("If-None-Match", headers["etag"])
+            if headers.get("lastmodified"):
+                request.add_header("If-Modified-Since", headers["lastmodified"])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            try:
+                data = response.read()
+                info = response.info()
+            finally:
+                response.close()
+        except urllib2.HTTPError as e:
+            if e.code == 304 and headers:
+                return None
+            return "{0}: {1}".format(url, e)
+        except Exception as e:
+            # URLError, socket errors and timeouts
+            return "{0}: {1}".format(url, e)
+        self.write(datafile, data)
+        self.write(headerfile, json.dumps({
+            "url": url,
+            "etag": info.getheader("ETag"),
+            "lastmodified": info.getheader("Last-Modified"),
+            "subtype": info.getsubtype()}))
+        return None
+
+    def prefetch(self, urls):
+        """
+        Fetches or revalidates images concurrently. Returns a dictionary with
+        the error message per URL that could not be fetched.
+
+        Arguments:
+          urls (list):  The URLs of the images.
+        """
+        urls = sorted(set(urls))
+        if not urls:
+            return {}
+        pool = multiprocessing.pool.ThreadPool(min(FETCHTHREADS, len(urls)))
+        try:
+            results = pool.map(self.fetch, urls)
+        finally:
+            pool.close()
+            pool.join()
+        return dict((url, error) for (url, error) in zip(urls, results) if error)
+
+    def get(self, url):
+        """
+        Returns a tuple (filename, extension) of a cached image, or None when
+        the image is not in the cache.
+
+        Arguments:
+          url (str):    The URL of the image.
+        """
+        headers = self.headers(url)
+        if headers is None:
+            return None
+        fileext = os.path.splitext(urlparse.urlparse(url).path)[1]
+        if not fileext:
+            fileext = ".{}".format(headers.get("subtype"))
+        return (self.filenames(url)[0], fileext)
@@ -39,9 +39,22 @@ import tempfile
 import traceback
 import datetime
 import tarfile
+import multiprocessing
+import sqlite3
+import xml.sax
 import xeputils.xep
 import xeputils.xeptable
 import xeputils.mail
+import xeputils.manifest
+import xeputils.cache
+import xeputils.index
+import xeputils.gitrepo
+import xeputils.xslt
+import xeputils.workspace
+import xeputils.builder
+import xeputils.stagecache
+import xeputils.remoteimages
+import xeputils.trace
 
 
 def prepDir(path=None):
@@ -65,6 +78,61 @@ def prepDir(path=None):
     return path
 
 
+def parseJob(job):
+    """
+    Utility function, parses one XEP. Used as the worker function when parsing
+    in parallel, so it lives on module level. Returns a tuple with the
+    filename, the metadata of the XEP (see XEP.getMeta), the error
+    message when it could not be parsed and the trace events. The XEP object
+    itself (with its XML tree) stays in the worker.
+
+    Arguments:
+      job (tuple):  A tuple (filename, outpath, xslpath, imagespath).
+    """
+    (fle, outpath, xslpath, imagespath) = job
+    try:
+        with xeputils.trace.Span("parse", "xep", fle) as span:
+            xep = xeputils.xep.XEP(fle,
+                                   outpath=outpath,
+                                   xslpath=xslpath,
+                                   imagespath=imagespath)
+            span.args["xep"] = str(xep)
+        return (fle, xep.getMeta(), None, xeputils.trace.collect())
+    except:
+        e = "Error while parsing {}\n".format(fle)
+        e += "FATAL: {} is not included\n".format(fle)
+        e += traceback.format_exc()
+        return (fle, None, e, xeputils.trace.collect())
+
+
+def buildJob(job):
+    """
+    Utility function, builds one or more stages of one XEP. Used as the worker
+    function when building in parallel, so it lives on module level. Returns
+    a tuple with the index of the job, a list of tuples (stage, errors) with
+    the build errors of each stage and the trace events.
+
+    Arguments:
+      job (tuple):  A tuple (index, stages, xep, outpath, xslpath, imagespath,
+                    workspace, maxpasses, texformat, stagecache), stages being
+                    a list with "xhtml" and/or "pdf".
+    """
+    (index, stages, xep, outpath, xslpath, imagespath, workspace, maxpasses,
+     texformat, stagecache) = job
+    results = []
+    for stage in stages:
+        # the xep is a copy in the worker, only report back what is new
+        xep.buildErrors = []
+        with xeputils.trace.Span("build " + stage, "xep", xep):
+            if stage == "xhtml":
+                xep.buildXHTML(outpath, xslpath, workspace)
+            else:
+                xep.buildPDF(outpath, xslpath, imagespath, workspace,
+                             maxpasses, texformat, stagecache, prefetch=False)
+        results.append((stage, xep.buildErrors))
+    return (index, results, xeputils.trace.collect())
+
+
 class AllXEPs(object):
     # TODO create a log/say method that contains the if showprogress; print code
     """
@@ -93,16 +161,90 @@ class AllXEPs(object):
                              the XEPs location is made when not suppied.
             imagespath (str): Directory to look for the images needed to build
                              the PDF files.
+            jobs (int):      Number of jobs to run in parallel when parsing
+                             and building.
+            rebuild (bool):  Ignore the build manifest and build all XEPs.
+            cachepath (str): Directory to keep the metadata cache in, defaults
+                             to the outpath.
+            nocache (bool):  Don't use the metadata cache.
+            index (bool):    Keep a SQLite index of the metadata of the XEPs
+                             in the cachepath, see MetadataIndex.
+            workpath (str):  Directory to create the build workspace in.
+            maxpasses (int): Maximum number of xelatex passes per PDF.
+            texformat (bool): Start xelatex from a precompiled format.
+            timeout (int):   Seconds to wait for a server when fetching remote
+                             images.
+            trace (str):     File to save a Chrome trace of the build stages
+                             in, tracing is off when not given.
+            xslt (str):      The XSLT engine to build with, 'xsltproc' or
+                             'lxml'. Falls back to xsltproc when lxml is not
+                             installed.
         """
         self.config = config
         self.outpath = prepDir(config.outpath)
         self.xslpath = config.xslpath
         self.imagespath = config.imagespath
+        self.jobs = config.jobs
+        self.rebuild = config.rebuild
+        self.workpath = config.workpath
+        self.maxpasses = config.maxpasses
+        self.texformat = config.texformat
+        self.timeout = config.timeout
+        self.trace = config.trace
+        xeputils.trace.enable(bool(self.trace))
         self.errors = []
         self.xeps = []
+        if config.xslt and xeputils.xslt.setEngine(config.xslt) != config.xslt:
+            self.errors.append(
+                "WARNING: XSLT engine {} is not available, using {}".format(
+                    config.xslt, xeputils.xslt.engine))
+        self.gitstatus = xeputils.gitrepo.GitStatus()
+        self.stamps = {}
+        files = self.listFiles()
+        # try if we can find an existing XEP-table:
+        if os.path.isfile(os.path.join(self.outpath, "xeps.xml")):
+            self.xeptable = os.path.join(self.outpath, "xeps.xml")
+        else:
+            self.xeptable = None
+        if config.nocache:
+            self.cache = None
+        else:
+            self.cache = xeputils.cache.MetadataCache(
+                prepDir(config.cachepath or self.outpath))
+        self.pool = None
+        if self.jobs > 1:
+            parsed = self.parseParallel(files, self.cache, self.jobs)
+        else:
+            parsed = {}
+        # read files to xeps
+        for fle in files:
+            (meta, error) = parsed.get(fle, (None, None))
+            if error:
+                self.errors.append(error)
+                continue
+            xep = self.loadXEP(fle, meta)
+            if xep:
+                self.xeps.append(xep)
+        self.saveCache()
+        self.index = None
+        if config.index:
+            try:
+                self.index = xeputils.index.MetadataIndex(
+                    prepDir(config.cachepath or self.outpath))
+            except sqlite3.Error as e:
+                self.errors.append(
+                    "WARNING: could not open the metadata index: {}".format(e))
+            self.updateIndex(files, self.xeps)
+
+    def listFiles(self):
+        """
+        Returns a sorted list with the full filenames of the XEPs given in the
+        'xeps' configuration, or of all xml files in the current working
+        directory when none are given.
+        """
         files = []
-        if config.xeps:
-            for xep in config.xeps:
+        if self.config.xeps:
+            for xep in self.config.xeps:
                 if os.path.isfile(xep):
                     files.append(os.path.abspath(xep))
                 elif os.path.isdir(xep):
@@ -117,24 +259,184 @@ class AllXEPs(object):
             fls = glob.glob(os.path.join(os.getcwd(), '*.xml'))
             for fle in fls:
                 files.append(os.path.abspath(fle))
-        # try if we can find an existing XEP-table:
-        if os.path.isfile(os.path.join(self.outpath, "xeps.xml")):
-            self.xeptable = os.path.join(self.outpath, "xeps.xml")
-        else:
-            self.xeptable = None
-        # read files to xeps
-        for fle in sorted(set(files)):
+        return sorted(set(files))
+
+    def stamp(self, fle):
+        """
+        Returns the modification time and the size of a file, or None when
+        it doesn't exist.
+        """
+        try:
+            st = os.stat(fle)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def loadXEP(self, fle, meta=None):
+        """
+        Returns a XEP object for a XEP file, or None when it could not be
+        parsed (the error is added to the errors of the repository).
+
+        Arguments:
+          fle (str):    The full filename of the XEP.
+          meta (dict):  The metadata of the XEP when parsed by a worker.
+        """
+        try:
+            # the metadata of parsed XEPs only has to be loaded
+            with xeputils.trace.Span("load" if meta else "parse", "xep",
+                                     fle) as span:
+                xep = xeputils.xep.XEP(fle,
+                                       outpath=self.outpath,
+                                       xslpath=self.xslpath,
+                                       imagespath=self.imagespath,
+                                       cache=self.cache,
+                                       gitstatus=self.gitstatus,
+                                       meta=meta)
+                span.args["xep"] = str(xep)
+            # the raw XML is read again when needed
+            xep.release()
+            self.stamps[fle] = self.stamp(fle)
+            return xep
+        except:
+            e = "Error while parsing {}\n".format(fle)
+            e += "FATAL: {} is not included\n".format(fle)
+            e += traceback.format_exc()
+            self.errors.append(e)
+            return None
+
+    def saveCache(self):
+        """
+        Saves the metadata cache, if any.
+        """
+        if self.cache:
+            try:
+                self.cache.save()
+            except (IOError, OSError) as e:
+                self.errors.append(
+                    "WARNING: could not save the metadata cache: {}".format(e))
+
+    def updateIndex(self, files, xeps=()):
+        """
+        Updates the metadata index, if any, with the XEP files.
+
+        Arguments:
+          files (list):     Full filenames of the XEPs.
+          xeps (list):      The XEP objects of the files that are parsed.
+        """
+        if self.index:
             try:
-                self.xeps.append(
-                    xeputils.xep.XEP(fle,
-     outpath=self.outpath,
-     xslpath=self.xslpath,
-     imagespath=self.imagespath))
-            except:
-                e = "Error while parsing {}\n".format(fle)
-                e += "FATAL: {} is not included\n".format(fle)
-                e += traceback.format_exc()
-                self.errors.append(e)
+                self.index.update(files, xeps)
+            except sqlite3.Error as e:
+                self.errors.append(
+                    "WARNING: could not update the metadata index: {}".format(e))
+
+    def reload(self, files):
+        """
+        Reads changed XEP files again: replaces the XEPs of changed files,
+        adds new files and drops the XEPs of removed files. Returns the list
+        of new and changed XEPs.
+
+        Arguments:
+          files (list):     Full filenames of the changed XEPs.
+        """
+        changed = []
+        for fle in sorted(set(files)):
+            current = [x for x in self.xeps if x.filename == fle]
+            for x in current:
+                self.xeps.remove(x)
+            if not os.path.isfile(fle):
+                continue
+            self.gitstatus.refresh(getattr(current[0], "gittoplevel", None)
+                                   if current else None)
+            xep = self.loadXEP(fle)
+            if xep:
+                self.xeps.append(xep)
+                changed.append(xep)
+        # keep the order of a new run
+        self.xeps.sort(key=lambda x: x.filename)
+        self.saveCache()
+        self.updateIndex(files, changed)
+        return changed
+
+    def rescan(self):
+        """
+        Lists the XEP files again, like a new run would, and reloads the new,
+        changed and removed files (see reload). A file counts as changed when
+        its modification time or size changed, its metadata is only parsed
+        again when the metadata cache has no entry for its contents. Returns
+        the list of new and changed XEPs.
+        """
+        files = self.listFiles()
+        loaded = set(x.filename for x in self.xeps)
+        changed = [fle for fle in files
+                   if fle not in loaded or self.stamps.get(fle) != self.stamp(fle)]
+        removed = sorted(loaded - set(files))
+        for fle in removed:
+            self.stamps.pop(fle, None)
+        return self.reload(changed + removed)
+
+    def startPool(self, jobs=None):
+        """
+        Starts a pool of worker processes that is kept for all following
+        builds, instead of starting a pool per build.
+
+        Arguments:
+          jobs (int):   Number of worker processes, defaults to the 'jobs'
+                        configuration.
+        """
+        self.stopPool()
+        self.pool = multiprocessing.Pool(jobs or self.jobs, xeputils.trace.clear)
+
+    def stopPool(self):
+        """
+        Stops the pool of worker processes started with startPool.
+        """
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def parseParallel(self, files, cache, jobs):
+        """
+        Parses the XEPs that are not in the metadata cache with a pool of
+        worker processes. Returns a dictionary with the results per filename:
+        tuples (meta, error) as returned by parseJob.
+
+        Arguments:
+          files (list):         Full filenames of the XEPs to parse.
+          cache (MetadataCache): The metadata cache, or None.
+          jobs (int):           Number of worker processes.
+        """
+        todo = []
+        for fle in files:
+            if cache:
+                try:
+                    f = open(fle, 'r')
+                    raw = f.read()
+                    f.close()
+                    if cache.get(fle, raw):
+                        continue
+                except IOError:
+                    # reported when reading it in the parent
+                    continue
+            todo.append(
+                (fle, self.outpath, self.xslpath, self.imagespath))
+        if len(todo) < 2:
+            return {}
+        parsed = {}
+        pool = multiprocessing.Pool(
+            min(jobs, len(todo)), xeputils.trace.clear)
+        try:
+            for (fle, meta, error, events) in pool.imap_unordered(parseJob, todo):
+                parsed[fle] = (meta, error)
+                xeputils.trace.add(events)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return parsed
 
     def getInterim(self):
         """
@@ -194,25 +496,60 @@ class AllXEPs(object):
 
     # TODO move showprogress to a class init parameter
     # TODO add xeps list to this method signature
-    def buildAll(self, showprogress=False):
+    def buildAll(self, showprogress=False, jobs=None, rebuild=None, only=None):
         """
         Generate XHTML and PDF Files for all XEPs, including a XHTML index
         table and a tarred bundle of generated PDF's.
-        Reverts interims before building.
-        """
+        Reverts interims before building. XEPs of which the inputs didn't
+        change since the previous build, according to the build manifest in
+        the outpath, are skipped.
+
+        Arguments:
+          showprogress (bool): Print the progress to stdout.
+          jobs (int):          Number of build jobs to run in parallel,
+                               defaults to the 'jobs' configuration.
+          rebuild (bool):      Ignore the build manifest and build all XEPs,
+                               defaults to the 'rebuild' configuration.
+          only (list):         Only build these XEPs, defaults to all XEPs.
+                               The index tables and the bundle always cover
+                               all XEPs.
+        """
+        if jobs is None:
+            jobs = self.jobs
+        if rebuild is None:
+            rebuild = self.rebuild
         if showprogress:
             sys.stdout.write("\rReverting interm XEPs")
             sys.stdout.flush()
-            counter = 1
-        self.revertInterims()
-        for xep in sorted(self.xeps):
-            if showprogress:
-                sys.stdout.write("\rBuilding XEP: ... {:<40}  [{}/{}]".format(
-                    xep.filename[-40:], counter, len(self.xeps)))
-                sys.stdout.flush()
-                counter += 1
-            xep.buildXHTML(self.outpath, self.xslpath)
-            xep.buildPDF(self.outpath, self.xslpath, self.imagespath)
+        self.revertInterims(only)
+        manifest = xeputils.manifest.BuildManifest(self.outpath)
+        if rebuild:
+            manifest.clear()
+        todo = []
+        for xep in sorted(self.xeps if only is None else only):
+            stages = [stage for stage in ("xhtml", "pdf")
+                      if not manifest.isUpToDate(xep, stage, self.xslpath, self.imagespath)]
+            if stages and self.checkBody(xep):
+                todo += [(xep, stage) for stage in stages]
+            xep.release()
+        if showprogress:
+            sys.stdout.write("\rFetching remote images")
+            sys.stdout.flush()
+        with xeputils.trace.Span("fetch remote images"):
+            self.prefetchImages(
+                [xep for (xep, stage) in todo if stage == "pdf"])
+        workspace = xeputils.workspace.Workspace(self.workpath)
+        stagecache = xeputils.stagecache.StageCache(self.outpath, rebuild)
+        try:
+            if jobs > 1:
+                self.buildParallel(
+                    todo, jobs, manifest, workspace, stagecache, showprogress)
+            else:
+                self.buildSerial(
+                    todo, manifest, workspace, stagecache, showprogress)
+        finally:
+            manifest.save()
+            workspace.close()
         if showprogress:
             sys.stdout.write("\rBuilding index table")
             sys.stdout.flush()
@@ -223,6 +560,171 @@ class AllXEPs(object):
         if showprogress:
             sys.stdout.write("\rDone!\n")
             sys.stdout.flush()
+        if self.trace:
+            self.saveTrace(self.trace)
+
+    def saveTrace(self, filename):
+        """
+        Saves the trace of the build stages as a Chrome trace and prints a
+        summary of the slowest stages and XEPs.
+
+        Arguments:
+          filename (str):   The file to save the trace in.
+        """
+        try:
+            xeputils.trace.save(filename)
+        except IOError as e:
+            self.errors.append(
+                "WARNING: could not save the build trace: {}".format(e))
+        print xeputils.trace.summary()
+
+    def checkBody(self, xep):
+        """
+        Returns True when the whole XML of a XEP is well-formed. Only the
+        header is read when loading a XEP, so a broken body shows up when the
+        XEP is build. The error is added to the parse errors of the XEP, which
+        shouldn't be build.
+
+        Arguments:
+          xep (XEP):    The XEP to check.
+        """
+        try:
+            # scanning for the images parses the whole XML
+            xep.images
+            return True
+        except xml.sax.SAXException as e:
+            error = "Malformed XML, not building the XEP: {}\n".format(e)
+            error += "  XEP file: {}".format(xep.filename)
+            if error not in xep.parseErrors:
+                xep.parseErrors.append(error)
+            return False
+
+    def prefetchImages(self, xeps=None):
+        """
+        Fetches the remote images of XEPs concurrently into the remote image
+        cache in the outpath, or revalidates the cached copies. The PDF builds
+        take the images from that cache.
+
+        Arguments:
+          xeps (list):  The XEPs to fetch the images of, defaults to all.
+        """
+        if xeps is None:
+            xeps = self.xeps
+        urls = [img for xep in xeps for img in xep.images
+                if xeputils.remoteimages.isRemote(img)]
+        remote = xeputils.remoteimages.ImageCache(self.outpath, self.timeout)
+        for (url, error) in sorted(remote.prefetch(urls).items()):
+            if remote.get(url):
+                self.errors.append(
+                    "WARNING: could not revalidate remote image, using the cached copy: {}".format(error))
+            else:
+                self.errors.append(
+                    "WARNING: could not fetch remote image: {}".format(error))
+
+    def buildDone(self, xep, stage, errors, manifest):
+        """
+        Bookkeeping after a build stage of a XEP: records successful builds
+        in the build manifest and forgets about failed ones. Releases the raw
+        XML of the XEP.
+        """
+        if errors:
+            manifest.forget(xep, stage)
+        else:
+            manifest.update(xep, stage, self.xslpath, self.imagespath)
+        xep.release()
+
+    def buildSerial(self, todo, manifest, workspace=None, stagecache=None,
+                    showprogress=False):
+        """
+        Builds the stages of the XEPs one by one.
+
+        Arguments:
+          todo (list):          List of (xep, stage) tuples to build.
+          manifest (manifest):  The build manifest to record the builds in.
+          workspace (Workspace): The workspace to build in.
+          stagecache (StageCache): Cache of the intermediate PDF artifacts.
+          showprogress (bool):  Print the progress to stdout.
+        """
+        for (counter, (xep, stage)) in enumerate(todo):
+            if showprogress:
+                sys.stdout.write("\rBuilding {:<5} ... {:<40}  [{}/{}]".format(
+                    stage.upper(), xep.filename[-40:], counter + 1, len(todo)))
+                sys.stdout.flush()
+            errors = len(xep.buildErrors)
+            with xeputils.trace.Span("build " + stage, "xep", xep):
+                if stage == "xhtml":
+                    xep.buildXHTML(self.outpath, self.xslpath, workspace)
+                else:
+                    xep.buildPDF(self.outpath, self.xslpath, self.imagespath,
+                                 workspace, self.maxpasses, self.texformat,
+                                 stagecache, prefetch=False)
+            self.buildDone(xep, stage, xep.buildErrors[errors:], manifest)
+
+    def buildParallel(self, todo, jobs, manifest, workspace=None,
+                      stagecache=None, showprogress=False):
+        """
+        Builds the stages of the XEPs with a pool of worker processes. All
+        XHTML jobs are scheduled first, so the (fast) XHTML files are all
+        published before the (slow) PDF builds finish. With the lxml engine
+        both stages of a XEP are build in the same job instead, so the worker
+        parses the XEP once for all stylesheets (see xeputils.xslt.parseXEP).
+        The build errors are collected in the XEP objects of this repository.
+
+        Arguments:
+          todo (list):          List of (xep, stage) tuples to build.
+          jobs (int):           Number of worker processes.
+          manifest (manifest):  The build manifest to record the builds in.
+          workspace (Workspace): The workspace to build in.
+          stagecache (StageCache): Cache of the intermediate PDF artifacts.
+          showprogress (bool):  Print the progress to stdout.
+        """
+        grouped = []
+        if xeputils.xslt.engine == "lxml":
+            for (xep, stage) in todo:
+                if grouped and grouped[-1][0] is xep:
+                    grouped[-1][1].append(stage)
+                else:
+                    grouped.append((xep, [stage]))
+        else:
+            for (xep, stage) in sorted(todo, key=lambda job: job[1] != "xhtml"):
+                grouped.append((xep, [stage]))
+        # stage the build dependencies before the workers get a copy of the
+        # workspace, so they are staged only once
+        workspace = xeputils.builder.getWorkspace(workspace)
+        for (xep, stage) in todo:
+            if stage == "xhtml":
+                xeputils.builder.stageXHTML(workspace, xep, self.xslpath)
+            else:
+                xeputils.builder.stagePDF(
+                    workspace, xep, self.xslpath, self.imagespath)
+        # a pool started with startPool stays up for the next build
+        pool = self.pool or multiprocessing.Pool(jobs, xeputils.trace.clear)
+        try:
+            counter = 1
+            for (index, results, events) in pool.imap_unordered(
+                    buildJob,
+                    [(index, stages, xep, self.outpath, self.xslpath, self.imagespath, workspace, self.maxpasses,
+                      self.texformat, stagecache)
+                     for (index, (xep, stages)) in enumerate(grouped)]):
+                xep = grouped[index][0]
+                xeputils.trace.add(events)
+                for (stage, errors) in results:
+                    xep.buildErrors.extend(errors)
+                    self.buildDone(xep, stage, errors, manifest)
+                    if showprogress:
+                        sys.stdout.write("\rBuilding {:<5} ... {:<40}  [{}/{}]".format(
+                            stage.upper(), xep.filename[-40:], counter, len(todo)))
+                        sys.stdout.flush()
+                    counter += 1
+        except:
+            if pool is self.pool:
+                self.pool = None
+            pool.terminate()
+            pool.join()
+            raise
+        if pool is not self.pool:
+            pool.close()
+            pool.join()
 
     def buildTables(self, xmlfile, htmlfile):
         """
@@ -233,13 +735,23 @@ class AllXEPs(object):
           xmlfile (str):  filename of the file to write the XML table to.
           htmlfile (str): filename of the file to write the HTML table to.
         """
-        t = xeputils.xeptable.XEPTable()
-        for xep in self.xeps:
-            # Do not include XEP readme and template in the table.
-            if isinstance( xep.nr, ( int, long ) ) :
-                t.updateXEP(xep)
-        t.writeXMLTable(xmlfile)
-        t.writeHTMLTable(htmlfile)
+        with xeputils.trace.Span("tables"):
+            t = xeputils.xeptable.XEPTable()
+            for xep in self.xeps:
+                # Do not include XEP readme and template in the table.
+                if isinstance( xep.nr, ( int, long ) ) :
+                    t.updateXEP(xep)
+            t.writeXMLTable(xmlfile)
+            t.writeHTMLTable(htmlfile)
+
+    def tableBatch(self):
+        """
+        Returns a TableBatch on the existing index tables in the outpath, to
+        update many XEPs and write the tables once. Updates are ignored when
+        there is no XML table yet.
+        """
+        return xeputils.xeptable.TableBatch(
+            self.xeptable, os.path.join(self.outpath, "xeplist.txt"))
 
     def updateHTMLTable(self, xmlfile, htmlfile):
         """
@@ -261,29 +773,52 @@ class AllXEPs(object):
         Arguments:
           name (str):      The name of the tarbal, defaults to 'xepbundle'
         """
-        fltr = os.path.join(os.path.abspath(self.outpath), '*.pdf')
-        files = sorted(glob.glob(fltr))
-        tar = tarfile.open(
-            os.path.join(self.outpath, "{}.tar.bz2".format(name)),
-            "w:bz2")
-        for name in files:
-            tar.add(
-                name, arcname="xepbundle/{}".format(os.path.basename(name)))
-        tar.close()
+        with xeputils.trace.Span("bundle"):
+            fltr = os.path.join(os.path.abspath(self.outpath), '*.pdf')
+            files = sorted(glob.glob(fltr))
+            tar = tarfile.open(
+                os.path.join(self.outpath, "{}.tar.bz2".format(name)),
+                "w:bz2")
+            for name in files:
+                tar.add(
+                    name, arcname="xepbundle/{}".format(os.path.basename(name)))
+            tar.close()
 
-    def revertInterims(self):
+    def revertInterims(self, xeps=None):
         """
         Reverts the interim XEPs to their last non-interim state.
-        """
-        for interim in self.getInterim():
-            interim.revertInterim()
+        Reads the history of each git repository once and shares it between
+        the interim XEPs in it.
+
+        Arguments:
+          xeps (list):  The XEPs to revert the interims of, defaults to all.
+        """
+        interims = [x for x in (self.xeps if xeps is None else xeps)
+                    if x.interim]
+        histories = {}
+        try:
+            for interim in interims:
+                toplevel = interim.gittoplevel
+                if toplevel and toplevel not in histories:
+                    histories[toplevel] = xeputils.gitrepo.GitHistory(
+                        toplevel,
+                        [x.filename for x in interims if x.gittoplevel == toplevel])
+                with xeputils.trace.Span("revert interim", "xep", interim):
+                    interim.revertInterim(histories.get(toplevel))
+        finally:
+            for history in histories.values():
+                history.close()
 
-    def processErrors(self):
+    def processErrors(self, xeps=None):
         """
         Prints an overview of errors that occured while parsing and building the
         XEPs.
+
+        Arguments:
+          xeps (list):  Only report the errors of these XEPs (and the generic
+                        errors), defaults to all XEPs.
         """
-        e = self.formatErrors()
+        e = self.formatErrors(xeps)
         if not self.config.nologtostdout:
             if e:
                 print e
@@ -304,18 +839,24 @@ class AllXEPs(object):
                 f.write("No errors")
             f.close()
 
-    def formatErrors(self):
+    def formatErrors(self, xeps=None):
         """
         If there were any during the parsing or the building of the XEPs, it
         returns a string with a nicely formatted list of errors, suitable for
         printing or including in a mail. Returns None if there weren't any
         errors (either because parsing and building went perfect or because
         there were no XEPs parsed or build yet).
+
+        Arguments:
+          xeps (list):  Only include the errors of these XEPs (and the generic
+                        errors), defaults to all XEPs.
         """
         errorlist = []
         xepsWithErrors = sorted(
             set(self.getParseErrors() + self.getBuildErrors()),
             key=lambda x: str(x))
+        if xeps is not None:
+            xepsWithErrors = [x for x in xepsWithErrors if x in xeps]
         if self.getErrors() or xepsWithErrors:
             if self.getErrors():
                 errorlist.append("********** Read errors **********")
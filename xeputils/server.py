@@ -0,0 +1,368 @@
+# File: server.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+A long running build server, that keeps the metadata of all XEPs, the
+compiled stylesheets and the worker processes warm between builds. Requests
+are sent as one line of JSON over a Unix socket and answered with one line
+of JSON, see buildclient.py. Duplicate requests for the same XEP that are
+still queued are coalesced into one build.
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import threading
+import traceback
+import collections
+import SocketServer
+import xeputils.builder
+import xeputils.mail
+import xeputils.xslt
+import xeputils.workspace
+
+# The socket to listen on, when not configured. Keep in sync with
+# buildclient.py.
+SOCKET = os.path.join(tempfile.gettempdir(), "xepbuildserver.sock")
+# The requests the server understands
+ACTIONS = ("build", "defer", "tables", "status", "stop")
+
+
+class Request(object):
+    """
+    A queued request, shared by all clients that asked for the same.
+
+    Attributes:
+      action (str):     'build', 'defer' or 'tables'.
+      xep (str):        Full filename of the XEP, None for all XEPs.
+      done (Event):     Set when the request has been processed.
+      errors (str):     The formatted errors of the batch it was processed
+                        in, or None.
+      clients (int):    The number of clients that asked for it.
+    """
+
+    def __init__(self, action, xep=None):
+        self.action = action
+        self.xep = xep
+        self.done = threading.Event()
+        self.errors = None
+        self.clients = 1
+
+
+class BuildQueue(object):
+    """
+    Queue of requests that coalesces a request with an identical request
+    that is still waiting. All waiting requests are taken at once, so they
+    are processed in one batch.
+
+    Attributes:
+      pending (OrderedDict):    The waiting requests per (action, xep).
+      condition (Condition):    Guards pending.
+    """
+
+    def __init__(self):
+        self.pending = collections.OrderedDict()
+        self.condition = threading.Condition()
+
+    def put(self, action, xep=None):
+        """
+        Queues a request, or returns the identical request that is already
+        waiting.
+
+        Arguments:
+          action (str):     'build', 'defer' or 'tables'.
+          xep (str):        Full filename of the XEP, None for all XEPs.
+        """
+        with self.condition:
+            key = (action, xep)
+            if key in self.pending:
+                self.pending[key].clients += 1
+            else:
+                self.pending[key] = Request(action, xep)
+                self.condition.notify()
+            return self.pending[key]
+
+    def take(self, timeout=None):
+        """
+        Waits for requests and returns all waiting requests, an empty list
+        when none arrived within timeout seconds.
+        """
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            batch = self.pending.values()
+            self.pending = collections.OrderedDict()
+            return batch
+
+    def __len__(self):
+        with self.condition:
+            return len(self.pending)
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Reads one request from a client and writes the response.
+    """
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            response = self.server.buildserver.handle(message)
+        except ValueError as e:
+            response = {"status": "error", "errors": "Invalid request: {}".format(e)}
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Unix socket server that handles each client in its own thread, so
+    clients can wait for their builds while others queue requests.
+    """
+    daemon_threads = True
+
+
+class BuildServer(object):
+    """
+    Builds the XEPs of a repository on request. The requests are processed
+    one batch at a time by a single builder thread.
+
+    Attributes:
+      xeps (AllXEPs):       The repository, loaded once.
+      socketpath (str):     The Unix socket the server listens on.
+      queue (BuildQueue):   The waiting requests.
+      running (bool):       False when the server is stopping.
+      busy (list):          The requests of the batch that is processed.
+      server (UnixServer):  The socket server, while running.
+    """
+
+    def __init__(self, xeps, socketpath=None):
+        """
+        Arguments:
+          xeps (AllXEPs):       The repository to build.
+          socketpath (str):     The Unix socket to listen on, defaults to
+                                SOCKET.
+        """
+        self.xeps = xeps
+        self.socketpath = socketpath or SOCKET
+        self.queue = BuildQueue()
+        self.running = True
+        self.busy = []
+        self.server = None
+
+    def warmUp(self):
+        """
+        Compiles the stylesheets (when building with lxml) and starts the
+        worker processes, which inherit the compiled stylesheets.
+        """
+        if xeputils.xslt.engine == "lxml":
+            xslpaths = set(xeputils.builder.getXSLPath(x, self.xeps.xslpath)
+                           for x in self.xeps.xeps)
+            names = set(xeputils.builder.XHTMLDEPS + xeputils.builder.PDFDEPS)
+            for xslpath in xslpaths:
+                for name in sorted(names):
+                    if name.endswith(".xsl") and os.path.isfile(os.path.join(xslpath, name)):
+                        try:
+                            xeputils.xslt.getStylesheet(os.path.join(xslpath, name))
+                        except xeputils.xslt.etree.Error as e:
+                            self.xeps.errors.append(
+                                "WARNING: could not compile {}: {}".format(name, e))
+        if self.xeps.jobs > 1:
+            self.xeps.startPool()
+
+    def findXEP(self, name):
+        """
+        Returns the full filename for a XEP in a request: either a filename
+        or a XEP number. Raises a ValueError for an unknown number.
+        """
+        if os.path.isabs(name):
+            return name
+        try:
+            nr = int(name)
+        except ValueError:
+            raise ValueError("Not a full filename or a XEP number: {}".format(name))
+        for xep in self.xeps.xeps:
+            if xep.nr == nr:
+                return xep.filename
+        raise ValueError("Unknown XEP: {}".format(name))
+
+    def handle(self, message):
+        """
+        Handles a request from a client and returns the response. Waits until
+        the request is processed when the message asks for it.
+
+        Arguments:
+          message (dict):   The request, with the keys 'action', 'xeps' (a
+                            list of filenames or numbers, all XEPs when
+                            empty) and 'wait'.
+        """
+        action = message.get("action")
+        if action not in ACTIONS:
+            return {"status": "error",
+                    "errors": "Unknown action: {}".format(action)}
+        if action == "status":
+            return {"status": "ok", "xeps": len(self.xeps.xeps),
+                    "queued": len(self.queue),
+                    "busy": [(r.action, r.xep) for r in self.busy]}
+        if action == "stop":
+            self.running = False
+            threading.Thread(target=self.server.shutdown).start()
+            return {"status": "ok"}
+        try:
+            targets = [self.findXEP(x) for x in message.get("xeps") or []]
+        except ValueError as e:
+            return {"status": "error", "errors": str(e)}
+        if action == "defer" and not targets:
+            return {"status": "error", "errors": "No XEPs to defer given"}
+        if action == "tables" or not targets:
+            targets = [None]
+        requests = [self.queue.put(action, target) for target in targets]
+        if not message.get("wait"):
+            return {"status": "queued",
+                    "coalesced": sum(1 for r in requests if r.clients > 1)}
+        for request in requests:
+            # wait() without a timeout can not be interrupted in Python 2
+            while not request.done.wait(60):
+                pass
+        errors = "\n".join(sorted(set(r.errors for r in requests if r.errors)))
+        return {"status": "done", "errors": errors or None}
+
+    def process(self, batch):
+        """
+        Processes a batch of requests: reloads the XEPs to build, defers
+        XEPs and rebuilds the (changed) XEPs and the index tables. Returns
+        the XEPs that were built or deferred, None when all XEPs were built.
+
+        Arguments:
+          batch (list):     The Request objects to process.
+        """
+        xeps = self.xeps
+        xeps.errors = []
+        # errors of earlier batches have been reported already
+        for xep in xeps.xeps:
+            xep.buildErrors = []
+        # files may have been edited or committed since the last batch
+        xeps.gitstatus.refresh()
+        builds = [r.xep for r in batch if r.action == "build"]
+        defers = [r.xep for r in batch if r.action == "defer"]
+        if None in builds:
+            # like a new run: pick up new, changed and removed XEPs
+            xeps.rescan()
+            only = None
+        else:
+            only = xeps.reload(builds)
+        deferred = [x for x in xeps.xeps if x.filename in defers]
+        if deferred:
+            # a workspace per batch, so changed build dependencies are used
+            workspace = xeputils.workspace.Workspace(xeps.workpath)
+            try:
+                for xep in deferred:
+                    xep.defer(workspace)
+                    if xeps.config.sendmail:
+                        xeputils.mail.Deferred(xeps.config, xep).send()
+            finally:
+                workspace.close()
+        if builds:
+            xeps.buildAll(only=only)
+        else:
+            xeps.buildTables(os.path.join(xeps.outpath, "xeps.xml"),
+                             os.path.join(xeps.outpath, "xeplist.txt"))
+        return None if only is None else only + deferred
+
+    def work(self):
+        """
+        The builder thread: processes the queued requests until the server
+        stops.
+        """
+        while self.running:
+            batch = self.queue.take(1)
+            if not batch:
+                continue
+            self.busy = batch
+            try:
+                processed = self.process(batch)
+                errors = self.xeps.formatErrors(processed)
+                self.xeps.processErrors(processed)
+            except Exception:
+                errors = traceback.format_exc()
+                print errors
+            sys.stdout.flush()
+            self.busy = []
+            for request in batch:
+                request.errors = errors
+                request.done.set()
+
+    def removeStale(self):
+        """
+        Removes the socket of a server that is not running anymore. Raises
+        an IOError when a server is still listening on it.
+        """
+        if not os.path.exists(self.socketpath):
+            return
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.socketpath)
+        except socket.error:
+            os.remove(self.socketpath)
+            return
+        finally:
+            s.close()
+        raise IOError(
+            "A build server is already listening on {}".format(self.socketpath))
+
+    def run(self):
+        """
+        Listens for requests until a 'stop' request or until interrupted.
+        """
+        self.removeStale()
+        self.warmUp()
+        worker = threading.Thread(target=self.work)
+        worker.daemon = True
+        worker.start()
+        self.server = UnixServer(self.socketpath, RequestHandler)
+        self.server.buildserver = self
+        os.chmod(self.socketpath, 0600)
+        print "Listening on {}".format(self.socketpath)
+        sys.stdout.flush()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            worker.join()
+            self.server.server_close()
+            os.remove(self.socketpath)
+            self.xeps.stopPool()
@@ -0,0 +1,210 @@
+# File: stagecache.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Cache of the intermediate artifacts of the PDF build: the tex.xml, the TeX
+source, the final auxiliary files and the PDF. Each artifact is stored under
+a hash of the inputs of the stage that produced it, so a stage is skipped
+when its inputs were seen before, even when the XEP itself changed (e.g.
+whitespace or comments).
+"""
+
+import os
+import glob
+import hashlib
+import tempfile
+
+
+class Recorder(object):
+
+    """
+    File like object that passes on the reads from a stream and records
+    the data read, to cache a stream while it is being processed.
+
+    Attributes:
+      stream (file):    The stream to read from.
+      data (list):      The chunks read so far.
+    """
+
+    def __init__(self, stream):
+        """
+        Arguments:
+          stream (file):    The stream to read from.
+        """
+        self.stream = stream
+        self.data = []
+
+    def read(self, size=-1):
+        """
+        Reads from the stream, see file.read.
+        """
+        chunk = self.stream.read(size)
+        self.data.append(chunk)
+        return chunk
+
+    def getvalue(self):
+        """
+        Returns all data read so far.
+        """
+        return "".join(self.data)
+
+
+class StageCache(object):
+
+    """
+    Store of build artifacts in the STOREDIR directory of an outpath. Only
+    the latest artifact per XEP and stage is kept.
+
+    Attributes:
+        path (str):       The full path of the store.
+        refresh (bool):   Don't use stored artifacts, only store new ones.
+    """
+    STOREDIR = ".stagecache"
+
+    def __init__(self, outpath, refresh=False):
+        """
+        Arguments:
+          outpath (str):    The path the XEPs are build in.
+          refresh (bool):   Don't use stored artifacts, only store new ones.
+        """
+        self.path = os.path.join(outpath, self.STOREDIR)
+        self.refresh = refresh
+
+    def key(self, data=(), files=()):
+        """
+        Returns the key for a stage: a hash of its inputs.
+
+        Arguments:
+          data (list):  Strings the stage depends on.
+          files (list): Files the stage depends on, missing files are
+                        ignored.
+        """
+        h = hashlib.sha1()
+        for item in data:
+            h.update(str(len(item)))
+            h.update(item)
+        for filename in files:
+            if os.path.isfile(filename):
+                f = open(filename, "rb")
+                content = f.read()
+                f.close()
+                h.update(os.path.basename(filename))
+                h.update(str(len(content)))
+                h.update(content)
+        return h.hexdigest()
+
+    def filename(self, xep, stage, key):
+        """
+        Returns the filename of an artifact.
+
+        Arguments:
+          xep (XEP):    The XEP.
+          stage (str):  The name of the artifact, e.g. "texxml" or "pdf".
+          key (str):    The key of the inputs.
+        """
+        return os.path.join(
+            self.path, "{0}.{1}.{2}".format(xep.nrFormatted, stage, key))
+
+    def get(self, xep, stage, key):
+        """
+        Returns the stored artifact, or None when the inputs are unknown.
+
+        Arguments:
+          xep (XEP):    The XEP.
+          stage (str):  The name of the artifact, e.g. "texxml" or "pdf".
+          key (str):    The key of the inputs.
+        """
+        if self.refresh:
+            return None
+        try:
+            f = open(self.filename(xep, stage, key), "rb")
+        except IOError:
+            return None
+        data = f.read()
+        f.close()
+        return data
+
+    def latest(self, xep, stage):
+        """
+        Returns the latest stored artifact, whatever the inputs were, or
+        None if there is none.
+
+        Arguments:
+          xep (XEP):    The XEP.
+          stage (str):  The name of the artifact, e.g. "aux".
+        """
+        if self.refresh:
+            return None
+        for filename in glob.glob(self.filename(xep, stage, "*")):
+            try:
+                f = open(filename, "rb")
+            except IOError:
+                continue
+            data = f.read()
+            f.close()
+            return data
+        return None
+
+    def put(self, xep, stage, key, data):
+        """
+        Stores an artifact, replacing the previous one of the XEP.
+
+        Arguments:
+          xep (XEP):    The XEP.
+          stage (str):  The name of the artifact, e.g. "texxml" or "pdf".
+          key (str):    The key of the inputs.
+          data (str):   The artifact.
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # created by a parallel build
+                pass
+        filename = self.filename(xep, stage, key)
+        for old in glob.glob(self.filename(xep, stage, "*")):
+            if old != filename:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        # write and rename, so parallel builds never see half an artifact,
+        # the leading dot keeps it out of the globs above
+        (fd, tmpname) = tempfile.mkstemp(
+            prefix=".{}".format(os.path.basename(filename)), dir=self.path)
+        f = os.fdopen(fd, 'wb')
+        f.write(data)
+        f.close()
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
@@ -0,0 +1,218 @@
+# File: texformat.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Precompiled TeX formats of the common preamble of the XEPs. Loading the
+packages of the preamble is a large part of each xelatex pass, with a format
+they are loaded only once, when the format is dumped.
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import time
+import subprocess
+import xeputils.trace
+
+# Seconds after which dumping a format that failed is tried again, the
+# failure may have been temporary (e.g. a full disk or a TeX upgrade)
+RETRYINTERVAL = 24 * 60 * 60
+
+# The last line of the preamble that loads a package, the part of the
+# preamble up to and including this line is dumped in the format
+LASTPACKAGE = re.compile(
+    r"\A.*^[ \t]*\\(?:documentclass|usepackage|RequirePackage)\b[^\n]*\n",
+    re.MULTILINE | re.DOTALL)
+
+
+def splitPreamble(rawtex):
+    """
+    Returns a tuple (prefix, rest): the start of the TeX source that loads
+    the packages and the remaining TeX source. Returns None when there is no
+    such prefix.
+
+    Arguments:
+      rawtex (str): The TeX source of a XEP.
+    """
+    end = rawtex.find("\\begin{document}")
+    if end < 0:
+        return None
+    match = LASTPACKAGE.match(rawtex[:end])
+    if not match:
+        return None
+    return (match.group(0), rawtex[match.end():])
+
+
+class FormatStore(object):
+
+    """
+    Store of the precompiled formats in the STOREDIR directory of an outpath,
+    next to the build manifest. The formats are named after a hash of the
+    dumped preamble and the build dependencies, so a format is dumped again
+    only when the stylesheet or the dependencies change. When a format
+    cannot be dumped this is remembered in the store for RETRYINTERVAL
+    seconds, so it isn't tried over and over again.
+
+    Attributes:
+        path (str):     The full path of the store.
+    """
+    STOREDIR = ".texformats"
+
+    def __init__(self, outpath):
+        """
+        Arguments:
+          outpath (str):    The path the XEPs are build in.
+        """
+        self.path = os.path.join(outpath, self.STOREDIR)
+
+    def key(self, prefix, temppath, deps):
+        """
+        Returns the name of the format for the prefix.
+
+        Arguments:
+          prefix (str):     The part of the preamble to dump.
+          temppath (str):   The directory with the build dependencies.
+          deps (list):      The filenames of the build dependencies the
+                            preamble may load, relative to temppath.
+        """
+        h = hashlib.sha1(prefix)
+        for fle in deps:
+            filename = os.path.join(temppath, os.path.basename(fle))
+            if os.path.isfile(filename):
+                f = open(filename, "rb")
+                h.update(f.read())
+                f.close()
+        return "xep-{}".format(h.hexdigest())
+
+    def hasFailed(self, name):
+        """
+        Returns True when dumping the format failed less than RETRYINTERVAL
+        seconds ago. Removes the marker of an older failure.
+
+        Arguments:
+          name (str):       The name of the format.
+        """
+        marker = os.path.join(self.path, "{}.failed".format(name))
+        try:
+            if time.time() - os.path.getmtime(marker) < RETRYINTERVAL:
+                return True
+            os.remove(marker)
+        except OSError:
+            # no marker, or removed by a parallel build
+            pass
+        return False
+
+    def dump(self, name, prefix, temppath):
+        """
+        Dumps the format with xelatex and saves it in the store. Returns True
+        on success.
+
+        Arguments:
+          name (str):       The name of the format.
+          prefix (str):     The part of the preamble to dump.
+          temppath (str):   The directory with the build dependencies.
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # created by a parallel build
+                pass
+        dumppath = tempfile.mkdtemp(prefix=name, dir=temppath)
+        try:
+            f = open(os.path.join(dumppath, "{}.tex".format(name)), "w")
+            f.write(prefix)
+            f.write("\\dump\n")
+            f.close()
+            # run in temppath, that has the dependencies of the preamble
+            with xeputils.trace.Span("xelatex format", "xelatex") as span:
+                p = subprocess.Popen(["xelatex", "-ini", "-interaction=batchmode",
+                                      "-output-directory", dumppath,
+                                      "&xelatex", os.path.join(dumppath, "{}.tex".format(name))],
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     cwd=temppath)
+                p.communicate()
+                span.status(p.returncode)
+            fmtfile = os.path.join(dumppath, "{}.fmt".format(name))
+            if p.returncode or not os.path.isfile(fmtfile):
+                open(os.path.join(self.path, "{}.failed".format(name)), "w").close()
+                return False
+            # rename, so parallel builds never see half a format
+            (fd, tmpname) = tempfile.mkstemp(prefix=name, dir=self.path)
+            os.close(fd)
+            shutil.copy(fmtfile, tmpname)
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, os.path.join(self.path, "{}.fmt".format(name)))
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            shutil.rmtree(dumppath, True)
+
+    def prepare(self, xep, rawtex, temppath, deps):
+        """
+        Prepares a xelatex run with a precompiled format: makes sure the
+        format is in the store, links it in temppath and writes the TeX
+        source without the dumped preamble. Returns the arguments for
+        xelatex, or None when no format can be used.
+
+        Arguments:
+          xep (XEP):        The XEP to build.
+          rawtex (str):     The complete TeX source of the XEP.
+          temppath (str):   The directory xelatex runs in.
+          deps (list):      The filenames of the build dependencies the
+                            preamble may load, relative to temppath.
+        """
+        split = splitPreamble(rawtex)
+        if not split:
+            return None
+        (prefix, rest) = split
+        name = self.key(prefix, temppath, deps)
+        fmtfile = os.path.join(self.path, "{}.fmt".format(name))
+        if self.hasFailed(name):
+            return None
+        if not os.path.isfile(fmtfile) and not self.dump(name, prefix, temppath):
+            return None
+        os.symlink(fmtfile, os.path.join(temppath, "{}.fmt".format(name)))
+        bodyfile = os.path.join(
+            temppath, "xep-{}-body.tex".format(xep.nrFormatted))
+        f = open(bodyfile, "w")
+        f.write(rest)
+        f.close()
+        return ["-fmt={}".format(name),
+                "-jobname=xep-{}".format(xep.nrFormatted),
+                bodyfile]
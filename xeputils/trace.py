@@ -0,0 +1,194 @@
+# File: trace.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Tracing of the build stages. When enabled, every stage records its wall and
+CPU time (including the child processes it waited for) and the exit status
+of its child process, if any. The events can be saved as a Chrome trace
+(load it in chrome://tracing or https://ui.perfetto.dev) and summarised.
+
+Worker processes record their own events, which are handed back to the
+parent with the results of a job, see collect.
+"""
+
+import os
+import json
+import time
+import threading
+
+# Tracing is off until enable is called
+enabled = False
+
+# The events recorded in this process
+events = []
+
+
+def enable(on=True):
+    """
+    Turns tracing on or off.
+
+    Arguments:
+      on (bool):    Trace or not.
+    """
+    global enabled
+    enabled = on
+
+
+def clear():
+    """
+    Forgets the events recorded in this process. Used as initializer of
+    worker processes, which otherwise inherit the events of the parent.
+    """
+    del events[:]
+
+
+def collect():
+    """
+    Returns the events recorded in this process and forgets them, to hand
+    them from a worker process to the parent.
+    """
+    collected = events[:]
+    clear()
+    return collected
+
+
+def add(collected):
+    """
+    Adds the events collected in a worker process.
+
+    Arguments:
+      collected (list): The events, as returned by collect.
+    """
+    events.extend(collected)
+
+
+class Span(object):
+
+    """
+    A traced stage, use as context manager:
+        with xeputils.trace.Span("xelatex", "pdf", xep) as span:
+            ...
+            span.status(p.returncode)
+    Does nothing when tracing is not enabled.
+
+    Attributes:
+      name (str):   The name of the stage.
+      cat (str):    The category of the stage, e.g. the build step.
+      args (dict):  Extra information shown with the event.
+    """
+
+    def __init__(self, name, cat="build", xep=None):
+        """
+        Arguments:
+          name (str):   The name of the stage.
+          cat (str):    The category of the stage.
+          xep (XEP):    The XEP the stage works on, if any.
+        """
+        self.name = name
+        self.cat = cat
+        self.args = {}
+        if xep is not None:
+            self.args["xep"] = str(xep)
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.time()
+            self.times = os.times()
+        return self
+
+    def __exit__(self, *exc):
+        if not enabled:
+            return
+        end = time.time()
+        times = os.times()
+        # own cpu time and that of the children waited for
+        self.args["cpu"] = round(sum(times[:4]) - sum(self.times[:4]), 6)
+        if exc[0] is not None:
+            self.args["exception"] = exc[0].__name__
+        events.append({"name": self.name,
+                       "cat": self.cat,
+                       "ph": "X",
+                       "ts": int(self.start * 1e6),
+                       "dur": int((end - self.start) * 1e6),
+                       "pid": os.getpid(),
+                       "tid": threading.current_thread().ident,
+                       "args": self.args})
+
+    def status(self, code):
+        """
+        Records the exit status of the child process of the stage.
+
+        Arguments:
+          code (int):   The exit status.
+        """
+        self.args["exit"] = code
+
+
+def save(filename):
+    """
+    Saves the recorded events as a Chrome trace.
+
+    Arguments:
+      filename (str):   The file to write to.
+    """
+    f = open(filename, "w")
+    json.dump({"traceEvents": sorted(events, key=lambda e: e["ts"]),
+               "displayTimeUnit": "ms"}, f)
+    f.close()
+
+
+def summary(top=10):
+    """
+    Returns a text summary of the recorded events: the stages and the XEPs
+    that took most time.
+
+    Arguments:
+      top (int):    The number of stages and XEPs to list.
+    """
+    stages = {}
+    xeps = {}
+    for e in events:
+        (count, dur, cpu) = stages.get(e["name"], (0, 0, 0.0))
+        stages[e["name"]] = (count + 1, dur + e["dur"], cpu + e["args"]["cpu"])
+        if e["cat"] == "xep" and "xep" in e["args"]:
+            xeps[e["args"]["xep"]] = xeps.get(e["args"]["xep"], 0) + e["dur"]
+    lines = ["Slowest stages (wall time, cpu time, count):"]
+    for (name, (count, dur, cpu)) in sorted(
+            stages.items(), key=lambda item: -item[1][1])[:top]:
+        lines.append("  {:<30} {:>9.3f}s {:>9.3f}s {:>6}".format(
+            name, dur / 1e6, cpu, count))
+    lines.append("Slowest XEPs (wall time):")
+    for (name, dur) in sorted(xeps.items(), key=lambda item: -item[1])[:top]:
+        lines.append("  {:<30} {:>9.3f}s".format(name, dur / 1e6))
+    return "\n".join(lines)
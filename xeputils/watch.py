@@ -0,0 +1,353 @@
+# File: watch.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Watches the XEP sources and the stylesheets and rebuilds on changes. Uses
+inotify when pyinotify is installed and falls back to polling the
+modification times otherwise. Bursts of changes (e.g. a checkout) are
+collected into one rebuild.
+"""
+
+import os
+import sys
+import abc
+import time
+import xeputils.builder
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# Seconds without changes before a burst of changes is considered complete
+DEBOUNCE = 1.0
+# Seconds between two scans of the watched directories when polling
+POLLINTERVAL = 1.0
+# The build dependencies that invalidate all XEPs when changed
+STYLESHEETS = set(xeputils.builder.XHTMLDEPS + xeputils.builder.PDFDEPS)
+
+
+def isIgnored(filename):
+    """
+    Utility function, returns True for hidden files, editor backups and swap
+    files, which never trigger a build.
+
+    Arguments:
+      filename (str):   The full filename of the changed file.
+    """
+    name = os.path.basename(filename)
+    return (name.startswith('.') or name.startswith('#') or
+            name.endswith('~') or os.path.splitext(name)[1] in ('.swp', '.swx'))
+
+
+class Watcher(object):
+    """
+    Abstract base class of the watchers, the subclasses implement poll.
+
+    Attributes:
+      paths (list):     The directories that are watched (not recursive).
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, paths):
+        """
+        Arguments:
+          paths (list): The directories to watch.
+        """
+        self.paths = [p for p in paths if os.path.isdir(p)]
+
+    @abc.abstractmethod
+    def poll(self, timeout=None):
+        """
+        Waits for changes for at most timeout seconds, or until there are
+        changes when timeout is None. Returns a set with the full filenames of
+        the changed, added and removed files.
+        """
+
+    def wait(self, debounce=DEBOUNCE):
+        """
+        Waits until files change and keeps collecting changes until there
+        were none for debounce seconds. Returns a sorted list with the full
+        filenames of the changed, added and removed files.
+
+        Arguments:
+          debounce (float): Seconds without changes that end a burst.
+        """
+        changed = set()
+        while not changed:
+            changed = self.poll()
+        while True:
+            more = self.poll(debounce)
+            if not more:
+                return sorted(changed)
+            changed |= more
+
+    def close(self):
+        """
+        Stops watching.
+        """
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    Watcher that compares the modification times and sizes of the files in
+    the watched directories every interval.
+
+    Attributes:
+      interval (float): Seconds between two scans.
+      snapshot (dict):  Tuples (mtime, size) of the files at the last scan.
+    """
+
+    def __init__(self, paths, interval=POLLINTERVAL):
+        Watcher.__init__(self, paths)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """
+        Returns a dictionary with the tuples (mtime, size) of all files in the
+        watched directories.
+        """
+        snapshot = {}
+        for path in self.paths:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            for name in names:
+                fle = os.path.join(path, name)
+                if isIgnored(fle):
+                    continue
+                try:
+                    st = os.stat(fle)
+                except OSError:
+                    continue
+                if os.path.isfile(fle):
+                    snapshot[fle] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = set(fle for fle in set(snapshot) | set(self.snapshot)
+                          if snapshot.get(fle) != self.snapshot.get(fle))
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is None:
+                time.sleep(self.interval)
+            elif time.time() >= deadline:
+                return changed
+            else:
+                time.sleep(min(self.interval, deadline - time.time()))
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watcher that gets the changes from inotify, so no scanning is needed.
+
+    Attributes:
+      manager (WatchManager):   The pyinotify watch manager.
+      notifier (Notifier):      The pyinotify notifier.
+      changed (set):            The changes that are not returned yet.
+    """
+    def __init__(self, paths):
+        Watcher.__init__(self, paths)
+        self.changed = set()
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, self.handle)
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE)
+        for path in self.paths:
+            self.manager.add_watch(path, mask)
+
+    def handle(self, event):
+        """
+        Collects the changed files, called by the notifier for each event.
+        """
+        if not event.dir and not isIgnored(event.pathname):
+            self.changed.add(event.pathname)
+
+    def poll(self, timeout=None):
+        while not self.changed:
+            if not self.notifier.check_events(
+                    None if timeout is None else int(timeout * 1000)):
+                break
+            self.notifier.read_events()
+            self.notifier.process_events()
+        (changed, self.changed) = (self.changed, set())
+        return changed
+
+    def close(self):
+        self.notifier.stop()
+
+
+def getWatcher(paths):
+    """
+    Returns an InotifyWatcher for the paths when pyinotify is installed, or a
+    PollingWatcher otherwise.
+
+    Arguments:
+      paths (list): The directories to watch.
+    """
+    if pyinotify:
+        return InotifyWatcher(paths)
+    return PollingWatcher(paths)
+
+
+class XEPWatcher(object):
+    """
+    Rebuilds the XEPs of a repository when their sources or the stylesheets
+    change. A changed XEP only rebuilds that XEP and the index tables, a
+    changed stylesheet or build dependency rebuilds all XEPs that depend on
+    it. The parsed metadata of the unchanged XEPs and the worker processes
+    are kept between the builds.
+
+    Attributes:
+      xeps (AllXEPs):       The repository to rebuild.
+      sourcedirs (set):     Directories of which new xml files are new XEPs.
+      xslpaths (set):       Directories with the stylesheets and build
+                            dependencies.
+      debounce (float):     Seconds without changes that end a burst.
+    """
+
+    def __init__(self, xeps, debounce=DEBOUNCE):
+        """
+        Arguments:
+          xeps (AllXEPs):   The (already build) repository to watch.
+          debounce (float): Seconds without changes that end a burst.
+        """
+        self.xeps = xeps
+        self.debounce = debounce
+        if xeps.config.xeps:
+            self.sourcedirs = set(os.path.abspath(x) for x in xeps.config.xeps
+                                  if os.path.isdir(x))
+        else:
+            self.sourcedirs = set([os.getcwd()])
+        self.xslpaths = set(xeputils.builder.getXSLPath(x, xeps.xslpath)
+                            for x in xeps.xeps)
+        # only the given files and directories are watched, not the outpath
+        self.outpath = os.path.abspath(xeps.outpath)
+
+    def paths(self):
+        """
+        Returns a sorted list with the directories to watch.
+        """
+        paths = set(self.sourcedirs) | self.xslpaths
+        paths |= set(os.path.dirname(x.filename) for x in self.xeps.xeps)
+        paths |= set(os.path.join(p, "deps") for p in self.xslpaths)
+        return sorted(p for p in paths if os.path.isdir(p))
+
+    def classify(self, changed):
+        """
+        Returns a tuple (sources, stylesheets) with the changed XEP files and
+        the changed build dependencies in a list of changed files.
+
+        Arguments:
+          changed (list):   Full filenames of the changed files.
+        """
+        known = set(x.filename for x in self.xeps.xeps)
+        sources = []
+        stylesheets = []
+        for fle in changed:
+            path = os.path.dirname(fle)
+            if fle in known:
+                sources.append(fle)
+            elif path in self.xslpaths and os.path.basename(fle) in STYLESHEETS:
+                stylesheets.append(fle)
+            elif (os.path.dirname(path) in self.xslpaths and
+                  os.path.basename(path) == "deps"):
+                stylesheets.append(fle)
+            elif (fle.endswith(".xml") and path in self.sourcedirs and
+                  path != self.outpath):
+                sources.append(fle)
+        return (sources, stylesheets)
+
+    def rebuild(self, sources, stylesheets, showprogress=False):
+        """
+        Reloads the changed XEPs and rebuilds them, or all XEPs when a
+        stylesheet changed, and the index tables. Returns the rebuild XEPs.
+
+        Arguments:
+          sources (list):       Full filenames of the changed XEP files.
+          stylesheets (list):   Full filenames of the changed dependencies.
+          showprogress (bool):  Print the progress to stdout.
+        """
+        self.xeps.errors = []
+        # errors of earlier builds have been reported already
+        for xep in self.xeps.xeps:
+            xep.buildErrors = []
+        changed = self.xeps.reload(sources)
+        only = None if stylesheets else changed
+        self.xeps.buildAll(showprogress=showprogress, only=only)
+        return self.xeps.xeps if only is None else only
+
+    def run(self, showprogress=False):
+        """
+        Watches and rebuilds until interrupted.
+
+        Arguments:
+          showprogress (bool):  Print the progress to stdout.
+        """
+        watcher = getWatcher(self.paths())
+        if self.xeps.jobs > 1:
+            self.xeps.startPool()
+        print "Watching {} for changes, press Ctrl-C to stop".format(
+            ", ".join(watcher.paths))
+        try:
+            while True:
+                (sources, stylesheets) = self.classify(
+                    watcher.wait(self.debounce))
+                if not sources and not stylesheets:
+                    continue
+                if stylesheets:
+                    print "Stylesheets changed: {}".format(
+                        ", ".join(os.path.basename(f) for f in stylesheets))
+                else:
+                    print "XEPs changed: {}".format(
+                        ", ".join(os.path.basename(f) for f in sources))
+                self.xeps.processErrors(
+                    self.rebuild(sources, stylesheets, showprogress))
+                sys.stdout.flush()
+                # new XEPs may live in directories that are not watched yet
+                if set(self.paths()) != set(watcher.paths):
+                    watcher.close()
+                    watcher = getWatcher(self.paths())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+            self.xeps.stopPool()
@@ -0,0 +1,203 @@
+# File: workspace.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Workspace for building XEPs. The build dependencies (stylesheets, TeX
+packages and images) are copied into a shared, read-only directory once,
+and only again when they change. Each build job gets a scratch directory
+with links to those shared files.
+"""
+
+import os
+import errno
+import atexit
+import shutil
+import tempfile
+
+# Prefix of the workspace directories
+PREFIX = "XEPworkspace_"
+# File in the workspace directory with the pid of the owning process
+PIDFILE = ".pid"
+
+
+def isAlive(pid):
+    """
+    Utility function, returns True if a process with the pid exists.
+
+    Arguments:
+      pid (int):    The pid of the process.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def removeStale(workpath=None):
+    """
+    Removes the workspaces left behind by crashed (killed) builds: workspace
+    directories of which the owning process doesn't exist anymore.
+
+    Arguments:
+      workpath (str):   The directory the workspaces are created in, defaults
+                        to the systems default temporary file location.
+    """
+    workpath = workpath or tempfile.gettempdir()
+    for name in os.listdir(workpath):
+        path = os.path.join(workpath, name)
+        if not name.startswith(PREFIX) or not os.path.isdir(path):
+            continue
+        try:
+            f = open(os.path.join(path, PIDFILE))
+            pid = int(f.read())
+            f.close()
+        except (IOError, ValueError):
+            continue
+        if not isAlive(pid):
+            makeWritable(path)
+            shutil.rmtree(path, True)
+
+
+def stamp(filename):
+    """
+    Utility function, returns the modification time and the size of a file,
+    or None when it doesn't exist.
+
+    Arguments:
+      filename (str):   The full filename.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def makeWritable(path):
+    """
+    Utility function, makes the read-only shared directories in a workspace
+    writable again, so they can be removed.
+
+    Arguments:
+      path (str):   The path of the workspace.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for dirname in dirnames:
+            os.chmod(os.path.join(dirpath, dirname), 0755)
+
+
+class Workspace(object):
+
+    """
+    A directory to build XEPs in. The workspace removes itself when closed,
+    at the latest when the process that created it exits. Workspaces of
+    builds that got killed are removed when the next workspace is created.
+    A workspace can be passed to worker processes, only the process that
+    created it removes it.
+
+    Attributes:
+      path (str):       The full path of the workspace.
+      owner (int):      The pid of the process that created the workspace.
+      staged (dict):    The shared directories with build dependencies, per
+                        (source path, files) tuple: tuples (stamps, path),
+                        stamps being the modification times and sizes of the
+                        files when they were copied.
+    """
+
+    def __init__(self, workpath=None):
+        """
+        Arguments:
+          workpath (str):   The directory to create the workspace in, e.g. on
+                            a tmpfs. Defaults to the systems default temporary
+                            file location.
+        """
+        if workpath and not os.path.isdir(workpath):
+            os.makedirs(workpath)
+        removeStale(workpath)
+        self.path = tempfile.mkdtemp(prefix=PREFIX, dir=workpath)
+        self.owner = os.getpid()
+        self.staged = {}
+        f = open(os.path.join(self.path, PIDFILE), "w")
+        f.write(str(self.owner))
+        f.close()
+        atexit.register(self.close)
+
+    def stage(self, srcpath, files):
+        """
+        Copies build dependencies to a shared, read-only directory in the
+        workspace, the first time they are asked for and again when one of
+        them changed since (e.g. in a long running build server). Returns the
+        path of the shared directory. Directories with outdated copies may
+        still be in use by running jobs, they are removed with the workspace.
+
+        Arguments:
+          srcpath (str):    The path to copy the files from.
+          files (list):     The filenames to copy, relative to srcpath.
+        """
+        key = (os.path.abspath(srcpath), tuple(files))
+        stamps = [stamp(os.path.join(srcpath, fle)) for fle in files]
+        if key not in self.staged or self.staged[key][0] != stamps:
+            shared = tempfile.mkdtemp(prefix="shared_", dir=self.path)
+            for fle in files:
+                shutil.copy(os.path.join(srcpath, fle), shared)
+            os.chmod(shared, 0555)
+            self.staged[key] = (stamps, shared)
+        return self.staged[key][1]
+
+    def job(self, *shared):
+        """
+        Creates a scratch directory for a build job, with links to the files
+        in the given shared directories. Returns the path of the directory,
+        remove it with shutil.rmtree when done.
+
+        Arguments:
+          shared (str):     Paths returned by stage.
+        """
+        path = tempfile.mkdtemp(prefix="job_", dir=self.path)
+        for directory in shared:
+            for fle in os.listdir(directory):
+                os.symlink(os.path.join(directory, fle),
+                           os.path.join(path, fle))
+        return path
+
+    def close(self):
+        """
+        Removes the workspace.
+        """
+        if os.getpid() != self.owner or not os.path.isdir(self.path):
+            return
+        makeWritable(self.path)
+        shutil.rmtree(self.path, True)
+        self.staged = {}
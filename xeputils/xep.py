@@ -33,13 +33,175 @@
 ## END LICENSE ##
 
 from xml.dom.minidom import parse, parseString, Document, getDOMImplementation
+from xml.dom import pulldom
+import xml.sax
+import xml.sax.handler
 import sys
 import os
 import shutil
 import re
 import datetime
 import subprocess
+import copy
+import StringIO
 import xeputils.builder
+import xeputils.gitrepo
+import xeputils.remoteimages
+import xeputils.repository
+
+# Size of the chunks fed to the parser when reading just the header
+PULLBUFSIZE = 2 ** 14
+
+# The git toplevels found so far, per directory, see getGitTopLevel
+gitTopLevels = {}
+
+
+def getGitTopLevel(path):
+    """
+    Returns the toplevel of the git repository the directory is in, or None
+    when it is not in a git repository. Git is run only once per directory,
+    the result is remembered in gitTopLevels.
+
+    Arguments:
+      path (str):   The full path of the directory.
+    """
+    if path not in gitTopLevels:
+        p = subprocess.Popen(["git", "rev-parse", "--show-toplevel"],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             cwd=path)
+        (out, error) = p.communicate()
+        if error:
+            gitTopLevels[path] = None
+        else:
+            gitTopLevels[path] = out.strip()
+    return gitTopLevels[path]
+
+
+class CDATAPullDOM(pulldom.PullDOM):
+
+    """
+    PullDOM content and lexical handler that keeps CDATA sections apart from
+    the text nodes, like minidom does.
+    """
+    inCDATA = False
+
+    def startCDATA(self):
+        self.inCDATA = True
+
+    def endCDATA(self):
+        self.inCDATA = False
+
+    def startDTD(self, name, publicId, systemId):
+        pass
+
+    def endDTD(self):
+        pass
+
+    def characters(self, chars):
+        if self.inCDATA:
+            node = self.document.createCDATASection(chars)
+            self.lastEvent[1] = [(pulldom.CHARACTERS, node), None]
+            self.lastEvent = self.lastEvent[1]
+        else:
+            pulldom.PullDOM.characters(self, chars)
+
+
+def makeParser():
+    """
+    Returns a SAX parser that doesn't load the external DTD and entities,
+    just like minidom.
+    """
+    parser = xml.sax.make_parser()
+    parser.setFeature(xml.sax.handler.feature_external_ges, False)
+    parser.setFeature(xml.sax.handler.feature_external_pes, False)
+    return parser
+
+
+class ImageScanner(xml.sax.handler.ContentHandler):
+
+    """
+    SAX content handler that collects the 'src' of all img tags in a XEP,
+    without building a tree.
+    """
+
+    def __init__(self):
+        xml.sax.handler.ContentHandler.__init__(self)
+        self.images = []
+        self.inXEP = False
+
+    def startElement(self, name, attrs):
+        if name == "xep":
+            self.inXEP = True
+        elif name == "img" and self.inXEP:
+            self.images.append(attrs["src"])
+
+
+class XEPEventStream(pulldom.DOMEventStream):
+
+    """
+    Pulldom event stream over the raw XML of a XEP. The XML is fed to the
+    parser in chunks, so the parser only reads as far as the events are
+    consumed. The external DTD and entities are not loaded, just like with
+    minidom.
+    """
+
+    def __init__(self, raw):
+        pulldom.DOMEventStream.__init__(
+            self, StringIO.StringIO(raw), makeParser(), PULLBUFSIZE)
+
+    def reset(self):
+        pulldom.DOMEventStream.reset(self)
+        self.pulldom = CDATAPullDOM()
+        self.parser.setContentHandler(self.pulldom)
+        self.parser.setProperty(
+            xml.sax.handler.property_lexical_handler, self.pulldom)
+
+
+def readHeader(raw):
+    """
+    Reads the raw XML of a XEP up to and including the header and returns the
+    header as minidom node. Stops parsing as soon as the header is closed.
+
+    Arguments:
+      raw (str):    The raw XML of the XEP.
+    """
+    events = XEPEventStream(raw)
+    inXEP = False
+    for (event, node) in events:
+        if event == pulldom.START_ELEMENT:
+            if node.tagName == "xep":
+                inXEP = True
+            elif node.tagName == "header" and inXEP:
+                events.expandNode(node)
+                return node
+    raise IndexError("No header found")
+
+
+def readImages(raw):
+    """
+    Scans the raw XML of a XEP for img tags and returns a list with their
+    'src' attributes.
+
+    Arguments:
+      raw (str):    The raw XML of the XEP.
+    """
+    parser = makeParser()
+    scanner = ImageScanner()
+    parser.setContentHandler(scanner)
+    parser.parse(StringIO.StringIO(raw))
+    return scanner.images
+
+
+def isInterim(raw):
+    """
+    Returns True when the header of the raw XML of a XEP has an 'interim' tag.
+    Only reads the header.
+
+    Arguments:
+      raw (str):    The raw XML of the XEP.
+    """
+    return bool(readHeader(raw).getElementsByTagName("interim"))
 
 
 class XEP(object):
@@ -47,6 +209,10 @@ class XEP(object):
     """
     Class describing a XEP, as parsed from its XML
 
+    To keep the memory use low when handling many XEPs, the attributes are
+    slots and the raw XML, the XML tree and the images are read when needed.
+    Call release() to free them again.
+
     Attributes:
         abstract (str):                 The XEP 'abstract'
         buildErrors (list):             A list of errors that occured while
@@ -59,6 +225,20 @@ class XEP(object):
         filename (str or None):         Full filename of the parsed XEP, None if
                                             the XEP was parsed from a raw XML
                                             string
+        fullparse (bool):               When True the full XML tree is parsed
+                                            when reading the XEP, otherwise
+                                            only the header is read and the
+                                            rest is parsed when needed.
+        gitstatus (GitStatus or None):  Shared snapshot of the git status, used
+                                            to check if the XEP is clean in git
+                                            without running git for each XEP.
+        gittoplevel (str or None):      The toplevel of the git repository the
+                                            XEP is in, None if it is not in a
+                                            git repository. Looked up on first
+                                            use.
+        images (list):                  List of strings with the 'src' of all
+                                            img tags in the XEP, read on first
+                                            use.
         imagespath (str or None):       Directory to look for the images needed to build
                                             the PDF files.
         interim (bool):                 True if the XEP has an 'interim' tag
@@ -80,7 +260,8 @@ class XEP(object):
                                             when None, a temporary path is used.
         parseErrors (list):             A list of errors that occured while
                                             parsing the XEP.
-        raw (str):                      The raw XML of the XEP as string.
+        raw (str):                      The raw XML of the XEP as string, read
+                                            from the file on first use.
         shortname (str or None):        The 'shortname', if the XEP has one,
                                             else None
         status (str):                   The 'status' of the XEP
@@ -89,13 +270,27 @@ class XEP(object):
         version (str):                  The full version string of the
                                             latest revision of the XEP
         xep (minidom document)          The full XML tree of the XEP as minidom
-                                            document
+                                            document, parsed on first use.
         xslpath (str or None):          Directory to look for the XSLT stylesheets and the
                                             other build depencies. A sensible guess based on
                                             the XEPs location is made when not suppied.
     """
-
-    def __init__(self, filename, outpath=None, xslpath=None, imagespath=None):
+    __slots__ = ("filename", "fullparse", "gitstatus", "xslpath",
+                 "imagespath", "outpath", "buildErrors", "parseErrors",
+                 "path", "nr", "nrFormatted", "title", "status", "type",
+                 "date", "version", "majorVersion", "minorVersion",
+                 "lastcall", "interim", "shortname", "abstract", "depends",
+                 "_raw", "_rawChanged", "_dom", "_images")
+    # The attributes read from the XML, as cached by getMeta/setMeta. The
+    # images are left out, inline images can be megabytes of base64, they
+    # are scanned for when needed.
+    METAFIELDS = ("nr", "nrFormatted", "title", "status", "type", "date",
+                  "version", "majorVersion", "minorVersion", "lastcall",
+                  "interim", "shortname", "abstract", "depends",
+                  "parseErrors")
+
+    def __init__(self, filename, outpath=None, xslpath=None, imagespath=None,
+                 fullparse=False, cache=None, gitstatus=None, meta=None):
         """
         Creates an XEP object.
 
@@ -105,41 +300,122 @@ class XEP(object):
             xslpath (str):   Directory to look for the XSL stylesheets and the
                              other build depencies. A sensible guess based on
                              the XEPs location is made when not suppied.
+            fullparse (bool): Parse the full XML tree with minidom instead of
+                             reading just the header.
+            cache (cache):   Optional metadata cache (MetadataCache object)
+                             to read the parsed metadata from, when the file
+                             did not change, and to store it in otherwise.
+            gitstatus (GitStatus): Optional snapshot of the git status, shared
+                             by all XEPs of a repository.
+            meta (dict):     Optional metadata as returned by getMeta, e.g.
+                             parsed by an other process, used instead of
+                             parsing the XML.
 
         """
         self.filename = os.path.abspath(filename)
+        self.fullparse = fullparse
+        self.gitstatus = gitstatus
         self.xslpath = None
         if xslpath:
             self.xslpath = os.path.abspath(xslpath)
         self.imagespath = None
         if imagespath:
             self.imagespath = os.path.abspath(imagespath)
-        # check if we are in a git repository and get the toplevel
-        p = subprocess.Popen(["git", "rev-parse", "--show-toplevel"],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             cwd=os.path.dirname(self.filename))
-        (out, error) = p.communicate()
-        if error:
-            self.gittoplevel = None
-        else:
-            self.gittoplevel = out.strip()
-        # parse the XEP
-        f = open(self.filename, 'r')
-        self.raw = f.read()
-        f.close()
+        # the raw XML is read from the file when needed
+        self._raw = None
+        self._rawChanged = False
+        self._dom = None
+        self._images = None
         self.outpath = outpath
         self.buildErrors = []
         self.parseErrors = []
-        self.readXEP()
+        cached = False
+        if meta is None and cache and not fullparse:
+            meta = cache.get(self.filename, self.raw)
+            cached = meta is not None
+        if meta:
+            self.setMeta(meta)
+        else:
+            self.readXEP()
+        # XEPs with errors get parsed again, so the errors get reported
+        # and the defaults (e.g. the date) are fresh
+        if cache and not cached and not self.parseErrors:
+            cache.put(self.filename, self.raw, self.getMeta())
+
+    @property
+    def raw(self):
+        """
+        The raw XML of the XEP as string, read from the file on first use.
+        """
+        if self._raw is None:
+            f = open(self.filename, 'r')
+            self._raw = f.read()
+            f.close()
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        """
+        Replaces the raw XML, e.g. by an older version from git. It is kept
+        until the XEP is read from its file again.
+        """
+        self._raw = raw
+        self._rawChanged = True
+        self._dom = None
+        self._images = None
+
+    def release(self):
+        """
+        Releases the raw XML, the XML tree and the images to save memory, they
+        are read again when needed. The raw XML is kept when it does not come
+        from the file, e.g. for reverted interim XEPs.
+        """
+        self._dom = None
+        self._images = None
+        if not self._rawChanged:
+            self._raw = None
+
+    @property
+    def xep(self):
+        """
+        The full XML tree of the XEP as minidom document, parsed on first use.
+        """
+        if self._dom is None:
+            self._dom = parseString(self.raw)
+        return self._dom
+
+    @property
+    def gittoplevel(self):
+        """
+        The toplevel of the git repository the XEP is in, or None.
+        """
+        return getGitTopLevel(os.path.dirname(self.filename))
+
+    @property
+    def images(self):
+        """
+        List with the 'src' of all img tags in the XEP, read on first use.
+        """
+        if self._images is None:
+            self._images = readImages(self.raw)
+        return self._images
 
     def readXEP(self):
         """
-        Parses the raw data for further processing.
+        Parses the raw data for further processing. Unless 'fullparse' is set,
+        only the header is parsed.
         """
-        self.xep = parseString(self.raw)
-        xepNode = (self.xep.getElementsByTagName("xep")[0])
-        headerNode = (xepNode.getElementsByTagName("header")[0])
+        if self.fullparse:
+            self._dom = parseString(self.raw)
+            xepNode = (self._dom.getElementsByTagName("xep")[0])
+            headerNode = (xepNode.getElementsByTagName("header")[0])
+            self._images = []
+            for img in xepNode.getElementsByTagName('img'):
+                self._images.append(img.attributes["src"].value)
+        else:
+            self._dom = None
+            self._images = None
+            headerNode = readHeader(self.raw)
         titleNode = (headerNode.getElementsByTagName("title")[0])
         self.title = self.__getText__(titleNode.childNodes)
         nr = self.__getText__(
@@ -227,10 +503,26 @@ class XEP(object):
             for dep in depNode.getElementsByTagName("spec"):
                 self.depends.append(self.__getText__(dep.childNodes))
 
-        imgs = xepNode.getElementsByTagName('img')
-        self.images = []
-        for img in imgs:
-            self.images.append(img.attributes["src"].value)
+    def getMeta(self):
+        """
+        Returns the attributes read from the XML (see METAFIELDS) as a
+        dictionary, e.g. for caching.
+        """
+        meta = {}
+        for field in self.METAFIELDS:
+            meta[field] = copy.copy(getattr(self, field))
+        return meta
+
+    def setMeta(self, meta):
+        """
+        Sets the attributes read from the XML from a dictionary as returned by
+        getMeta, instead of parsing the XML.
+        """
+        self.path = os.path.dirname(self.filename)
+        self._dom = None
+        self._images = None
+        for field in self.METAFIELDS:
+            setattr(self, field, copy.copy(meta[field]))
 
     def __str__(self):
         """
@@ -252,6 +544,25 @@ class XEP(object):
         """
         return self.__str__() < other.__str__()
 
+    def __getstate__(self):
+        """
+        Support for pickling, e.g. to hand the XEP over to a build process.
+        The minidom document is left out, it is parsed again when needed.
+        """
+        state = {}
+        for slot in self.__slots__:
+            if hasattr(self, slot):
+                state[slot] = getattr(self, slot)
+        state['_dom'] = None
+        return state
+
+    def __setstate__(self, state):
+        """
+        Support for unpickling.
+        """
+        for (slot, value) in state.items():
+            setattr(self, slot, value)
+
     def __processParsingError__(self, valuedescription):
         """
         Utility function, keeps track of of values that didn't parse ok.
@@ -296,15 +607,16 @@ class XEP(object):
         """
         Prints a nice overview of the parsed info of the XEP.
         """
-        items = self.__dict__.keys()
-        items.remove('xep')  # no need for this one
-        items.remove('raw')  # no need for this one
+        # no need for the git status and the private ones
+        items = [item for item in self.__slots__
+                 if item != 'gitstatus' and item[0] != "_"]
+        items += ['images', 'gittoplevel']
         items.sort(reverse=True)  # hack to get a nicer order
         print self.__str__()
         for item in items:
             if item == "images":
                 imgs = []
-                for img in self.__dict__[item]:
+                for img in self.images:
                     if img[:10] == "data:image":
                         (imgmeta, imgdata) = img.split(',', 1)
                         imgs.append(
@@ -313,7 +625,7 @@ class XEP(object):
                         imgs.append(img)
                 print "  {:<18}  {}".format(item, imgs)
             else:
-                print "  {:<18}  {}".format(item, self.__dict__[item])
+                print "  {:<18}  {}".format(item, getattr(self, item))
 
     def setDeferred(self):
         """
@@ -321,14 +633,17 @@ class XEP(object):
         """
         self.replaceElementText("status", "Deferred")
         # parse the XEP again
-        f = open(self.filename, 'r')
-        self.raw = f.read()
-        f.close()
+        self._raw = None
+        self._rawChanged = False
         self.readXEP()
 
-    def defer(self):
+    def defer(self, workspace=None):
         """
         Sets this XEP to deferred and rebuilds the HTML and PDF.
+
+        Arguments:
+          workspace (Workspace): The workspace to build in, see
+                            xeputils.workspace.
         """
         commitToGit = False
         if not self.gittoplevel:
@@ -341,8 +656,8 @@ class XEP(object):
                 self.buildErrors.append(
                     "WARNING: {0} has uncommitted changes, will not commit change to deferred.".format(str(self)))
         self.setDeferred()
-        self.buildXHTML()
-        self.buildPDF()
+        self.buildXHTML(workspace=workspace)
+        self.buildPDF(workspace=workspace)
         self.archive()
         if commitToGit:
             self.gitCommit("Deferring {}".format(str(self)))
@@ -370,6 +685,13 @@ class XEP(object):
         if not so or if an error occured (e.g. when not on a git repository).
         Returns True when the file is clean.
         """
+        if self.gitstatus:
+            (clean, error) = self.gitstatus.isClean(
+                self.filename, self.gittoplevel)
+            if error:
+                self.buildErrors.append(
+                    "WARNING: error reading git status: {}: {}".format(str(self), error))
+            return clean
         gitref = os.path.relpath(self.filename, self.gittoplevel)
         p = subprocess.Popen(
             ["git", "status", "--porcelain", gitref],
@@ -406,10 +728,20 @@ class XEP(object):
         if error:
             self.buildErrors.append(
                 "WARNING: error while committing {} to git: {}".format(str(self), error))
+        if self.gitstatus:
+            if error:
+                self.gitstatus.refresh(self.gittoplevel)
+            else:
+                self.gitstatus.markClean(self.filename, self.gittoplevel)
 
-    def revertInterim(self):
+    def revertInterim(self, history=None):
         """
         Uses git to revert an interim XEP to its last non-interim state.
+
+        Arguments:
+          history (GitHistory): Optional history index of the git repository
+                                the XEP is in, shared between XEPs. When not
+                                given, a history of just this XEP is read.
         """
         if not self.interim:
             return
@@ -417,38 +749,40 @@ class XEP(object):
             self.buildErrors.append(
                 "WARNING: {0} is not in a git repository, will be using interim XEPs")
             return
-        gitref = os.path.relpath(self.filename, self.gittoplevel)
-        p = subprocess.Popen(
-            ["git", "log", "--pretty=format:%H", gitref],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self.gittoplevel)
-        (out, error) = p.communicate()
-        if error:
-            self.buildErrors.append(
-                "WARNING: error reading git log, not reversing interim XEP {}: {}".format(str(self), error))
-            return
-        else:
-            commits = out.split('\n')
-            commitIndex = 1
-            while self.interim:
-                p = subprocess.Popen(
-                    ["git", "show", "{}:{}".format(
-                        commits[commitIndex], gitref)],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=self.gittoplevel)
-                (out, error) = p.communicate()
+        ownHistory = history is None
+        if ownHistory:
+            history = xeputils.gitrepo.GitHistory(
+                self.gittoplevel, [self.filename])
+        try:
+            (commits, error) = history.getCommits(self.filename)
+            if error:
+                self.buildErrors.append(
+                    "WARNING: error reading git log, not reversing interim XEP {}: {}".format(str(self), error))
+                return
+            # the newest commit is the current (interim) version
+            for commit in commits[1:]:
+                (blob, error) = history.getBlob(commit, self.filename)
                 if error:
                     self.buildErrors.append(
                         "WARNING: error reading git blob, not reversing interim XEP {}: {}".format(str(self), error))
                     return
-                else:
-                    self.raw = out
+                try:
+                    interim = isInterim(blob)
+                except Exception as e:
+                    self.buildErrors.append(
+                        "WARNING: error parsing git blob, not reversing interim XEP {}: {}".format(str(self), e))
+                    return
+                if not interim:
+                    self.raw = blob
                     self.readXEP()
-                commitIndex += 1
+                    return
+            self.buildErrors.append(
+                "WARNING: no non-interim version in git, not reversing interim XEP {}".format(str(self)))
+        finally:
+            if ownHistory:
+                history.close()
 
-    def buildXHTML(self, outpath=None, xslpath=None):
+    def buildXHTML(self, outpath=None, xslpath=None, workspace=None):
         """
         Generates a nice formatted XHTML file from the XEP.
 
@@ -459,14 +793,17 @@ class XEP(object):
           xslpath (str):    The path where the xsl stylesheets can be found. When
                             not specified a directory based on the xep file location
                             is guessed.
+          workspace (Workspace): The workspace to build in, see
+                            xeputils.workspace.
         """
         if not outpath and self.outpath:
             outpath = self.outpath
         if not xslpath and self.xslpath:
             xslpath = self.xslpath
-        xeputils.builder.buildXHTML(self, outpath, xslpath)
+        xeputils.builder.buildXHTML(self, outpath, xslpath, workspace)
 
-    def buildPDF(self, outpath=None, xslpath=None, imagespath=None):
+    def buildPDF(self, outpath=None, xslpath=None, imagespath=None, workspace=None,
+                 maxpasses=None, texformat=False, stagecache=None, prefetch=True):
         """
         Generates a nice formatted PDF file from the XEP.
 
@@ -477,6 +814,16 @@ class XEP(object):
           xslpath (str):    The path where the xsl stylesheets can be found. When
                             not specified a directory based on the xep file location
                             is guessed.
+          workspace (Workspace): The workspace to build in, see
+                            xeputils.workspace.
+          maxpasses (int):  The maximum number of xelatex passes.
+          texformat (bool): Start xelatex from a precompiled format of the
+                            preamble.
+          stagecache (StageCache): Cache of the intermediate artifacts, see
+                            xeputils.stagecache.
+          prefetch (bool):  Fetch the remote images into the remote image
+                            cache first. Not needed when they are prefetched
+                            for all XEPs by AllXEPs.
         """
         if not outpath and self.outpath:
             outpath = self.outpath
@@ -484,7 +831,16 @@ class XEP(object):
             xslpath = self.xslpath
         if not imagespath and self.imagespath:
             imagespath = self.imagespath
-        xeputils.builder.buildPDF(self, outpath, xslpath, imagespath)
+        if prefetch:
+            outpath = xeputils.repository.prepDir(outpath)
+            remote = xeputils.remoteimages.ImageCache(outpath)
+            for error in remote.prefetch(
+                    filter(xeputils.remoteimages.isRemote, self.images)).values():
+                self.buildErrors.append(
+                    "WARNING: could not fetch remote image: {}".format(error))
+        xeputils.builder.buildPDF(
+            self, outpath, xslpath, imagespath, workspace, maxpasses,
+            texformat, stagecache)
 
     def updateTable(self, xmlfile, htmlfile):
         """
@@ -495,7 +851,5 @@ class XEP(object):
           xmlfile (str):  filename of the XML table to be uptdated.
           htmlfile (str): filename of the HTML table to be updated.
         """
-        t = xeputils.xeptable.XEPTable(xmlfile)
-        t.updateXEP(self)
-        t.writeXMLTable(xmlfile)
-        t.writeHTMLTable(htmlfile)
+        with xeputils.xeptable.TableBatch(xmlfile, htmlfile) as tables:
+            tables.updateXEP(self)
@@ -32,7 +32,15 @@
 #
 ## END LICENSE ##
 
-from xml.dom.minidom import parse, parseString, Document, getDOMImplementation
+import os
+import StringIO
+import tempfile
+from xml.dom.minidom import parseString
+from xml.etree import cElementTree
+
+# The fields of a XEP in the index tables, in the order of the XML table
+FIELDS = ("number", "name", "type", "status", "updated", "shortname",
+          "abstract")
 
 HTMLTableHeader = """<table border="1" cellpadding="3" cellspacing="0" class="sortable" id="xeplist">
   <tr class="xepheader">
@@ -67,10 +75,133 @@ HTMLTableFooter = """
 """
 
 
+
+def escape(text):
+    """
+    Utility function, escapes text for the XML table the same way minidom
+    does, so the table doesn't change for its readers.
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(
+        "\"", "&quot;").replace(">", "&gt;")
+
+
+def encode(text):
+    """
+    Utility function, returns text as UTF-8 encoded str.
+    """
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
+
+
+def xepRecord(xep):
+    """
+    Utility function, returns the record (a dictionary with the FIELDS) of a
+    XEP for the index tables.
+
+    Arguments:
+      xep (xep): the XEP-object.
+    """
+    values = (xep.nrFormatted, xep.title, xep.type, xep.status,
+              xep.date.date(), xep.shortname, xep.abstract)
+    return dict((field, unicode(value) if value else u"")
+                for (field, value) in zip(FIELDS, values))
+
+
+def readXMLTable(filename):
+    """
+    Utility function, returns the records of all XEPs in an XML index table,
+    in the order of the table. Reads the table incrementally, without
+    building a DOM.
+
+    Arguments:
+      filename (str): the filename of the XML table.
+    """
+    records = []
+    for (event, elem) in cElementTree.iterparse(filename):
+        if elem.tag == "xep":
+            records.append(dict((field, elem.findtext(field) or u"")
+                                for field in FIELDS))
+            elem.clear()
+    return records
+
+
+class XMLTableWriter(object):
+
+    """
+    Writes the XML index table to a stream row by row, in the style of the
+    XMLGenerator of the sax module. Writes the same bytes as serialising the
+    table with minidom.
+
+    Attributes:
+      stream (file):    The stream to write to.
+      rows (int):       The number of rows written.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.rows = 0
+
+    def startDocument(self):
+        self.stream.write('<?xml version="1.0" ?><xeps')
+
+    def writeRow(self, record):
+        """
+        Writes the xep element of a record.
+        """
+        parts = [">" if not self.rows else "", "<xep>"]
+        for field in FIELDS:
+            if record[field]:
+                parts.append("<{0}>{1}</{0}>".format(
+                    field, escape(encode(record[field]))))
+            else:
+                # minidom drops empty text nodes when normalizing
+                parts.append("<{}/>".format(field))
+        parts.append("</xep>")
+        self.stream.write("".join(parts))
+        self.rows += 1
+
+    def endDocument(self):
+        self.stream.write("</xeps>" if self.rows else "/>")
+
+
+class HTMLTableWriter(object):
+
+    """
+    Writes the HTML index table to a stream row by row, instead of building
+    the whole table in memory first.
+
+    Attributes:
+      stream (file):    The stream to write to.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def startDocument(self):
+        self.stream.write(HTMLTableHeader)
+
+    def writeRow(self, record):
+        """
+        Writes the table row of a record.
+        """
+        self.stream.write(HTMLTableRow.format(
+            **dict((field, encode(value)) for (field, value) in record.items())))
+
+    def endDocument(self):
+        self.stream.write(HTMLTableFooter)
+
+
 class XEPTable(object):
 
     """
     Creates a HTML table (for the human reader) and XML table (for bots)
+
+    Attributes:
+      xmlfile (str):    The XML file the table was read from, or None.
+      records (list):   The records of the XEPs (see xepRecord), in the order
+                        of the table.
+      index (dict):     The records per formatted XEP number.
     """
 
     def __init__(self, xmlfile=None):
@@ -83,11 +214,20 @@ class XEPTable(object):
                          Single XEP in a set of existing indexes.
         """
         self.xmlfile = xmlfile
+        self.records = []
+        self.index = {}
         if xmlfile:
-            self.doc = parse(xmlfile)
-        else:
-            impl = getDOMImplementation()
-            self.doc = impl.createDocument(None, "xeps", None)
+            self.records = readXMLTable(xmlfile)
+            self.reindex()
+
+    def reindex(self):
+        """
+        Rebuilds the index of the records by number.
+        """
+        self.index = {}
+        for record in self.records:
+            # the first record of a number is the one that gets updated
+            self.index.setdefault(record["number"], record)
 
     def updateXEP(self, xep):
         """
@@ -97,33 +237,48 @@ class XEPTable(object):
         Arguments:
           xep (xep): the XEP-object to add or update.
         """
-        props = (("number", xep.nrFormatted),
-                 ("name", xep.title),
-                 ("type", xep.type),
-                 ("status", xep.status),
-                 ("updated", xep.date.date()),
-                 ("shortname", xep.shortname),
-                 ("abstract", xep.abstract))
-        x = self.doc.createElement("xep")
-        update = False
-        for xepNode in self.doc.getElementsByTagName("xep"):
-            if xepNode.getElementsByTagName("number")[0].childNodes[0].data == xep.nrFormatted:
-                x = xepNode
-                update = True
-                break
-        if update:
-            for prop in props:
-                x.getElementsByTagName(prop[0])[0].childNodes[0].data = prop[1]
+        record = xepRecord(xep)
+        if record["number"] in self.index:
+            self.index[record["number"]].update(record)
         else:
-            for prop in props:
-                p = self.doc.createElement(prop[0])
-                if prop[1]:
-                    t = self.doc.createTextNode(str(prop[1]))
-                else:
-                    t = self.doc.createTextNode("")
-                p.appendChild(t)
-                x.appendChild(p)
-            self.doc.childNodes[0].appendChild(x)
+            self.records.append(record)
+            self.index[record["number"]] = record
+
+    def write(self, writer):
+        """
+        Writes all records with a table writer.
+
+        Arguments:
+          writer (XMLTableWriter or HTMLTableWriter): the writer.
+        """
+        writer.startDocument()
+        for record in self.records:
+            writer.writeRow(record)
+        writer.endDocument()
+
+    def writeFile(self, filename, writerclass):
+        """
+        Writes all records to a file with a table writer. Writes to a
+        temporary file first, so readers never see a half written table.
+
+        Arguments:
+          filename (str):       the filename of the file to output to, will be
+                                overwritten.
+          writerclass (class):  XMLTableWriter or HTMLTableWriter.
+        """
+        (fd, tmpname) = tempfile.mkstemp(
+            prefix="." + os.path.basename(filename),
+            dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            f = os.fdopen(fd, 'wb')
+            self.write(writerclass(f))
+            f.close()
+            # mkstemp creates the file private, but the table is published
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        except:
+            os.remove(tmpname)
+            raise
 
     def writeXMLTable(self, filename):
         """
@@ -133,10 +288,7 @@ class XEPTable(object):
           filename (str): the filename of the file to output to, will be
           overwritten.
         """
-        self.doc.getElementsByTagName("xeps")[0].normalize()
-        f = open(filename, "wb")
-        self.doc.writexml(f)
-        f.close()
+        self.writeFile(filename, XMLTableWriter)
 
     def writeHTMLTable(self, filename):
         """
@@ -146,27 +298,75 @@ class XEPTable(object):
           filename (str): the filename of the file to output to, will be
           overwritten.
         """
-        html = HTMLTableHeader
-        for xep in self.doc.getElementsByTagName('xep'):
-            atribs = {}
-            # assume there is just one child node and that that is a textnode
-            for atrib in ("status", "number", "name", "type", "status", "updated"):
-                atribs[atrib] = xep.getElementsByTagName(
-                    atrib)[0].childNodes[0].data
-            html += HTMLTableRow.format(**atribs)
-        html += HTMLTableFooter
-        f = open(filename, "w")
-        f.write(html)
-        f.close()
+        self.writeFile(filename, HTMLTableWriter)
 
     def __str__(self):
         """
         The raw XML of the xep table.
         """
-        return self.doc.toprettyxml()
+        f = StringIO.StringIO()
+        self.write(XMLTableWriter(f))
+        return parseString(f.getvalue()).toprettyxml()
 
     def __repr__(self):
         """
         The raw XML of the xep table.
         """
         return self.__str__()
+
+
+class TableBatch(object):
+
+    """
+    Applies many updates to the existing index tables in memory and writes
+    each table once, when the batch is done. Use it as a context manager:
+
+        with TableBatch(xmlfile, htmlfile) as tables:
+            for xep in changed:
+                tables.updateXEP(xep)
+
+    The tables are also written when an exception ends the batch, so the
+    updates applied before it are not lost.
+
+    Attributes:
+      xmlfile (str):    The XML table to update, or None when there is no
+                        table yet; the updates are ignored then, as a table
+                        with only the updated XEPs would be incomplete.
+      htmlfile (str):   The HTML table to write.
+      table (XEPTable): The table, read when the batch starts.
+      updated (int):    The number of updates applied.
+    """
+
+    def __init__(self, xmlfile, htmlfile):
+        self.xmlfile = xmlfile
+        self.htmlfile = htmlfile
+        self.table = None
+        self.updated = 0
+
+    def __enter__(self):
+        if self.xmlfile:
+            self.table = XEPTable(self.xmlfile)
+        return self
+
+    def updateXEP(self, xep):
+        """
+        Updates or adds a XEP in the table in memory.
+
+        Arguments:
+          xep (xep): the XEP-object to add or update.
+        """
+        if self.table:
+            self.table.updateXEP(xep)
+            self.updated += 1
+
+    def commit(self):
+        """
+        Writes the tables, when anything was updated.
+        """
+        if self.table and self.updated:
+            self.table.writeXMLTable(self.xmlfile)
+            self.table.writeHTMLTable(self.htmlfile)
+            self.updated = 0
+
+    def __exit__(self, *exc):
+        self.commit()
@@ -0,0 +1,229 @@
+# File: xslt.py
+# Version: 0.3
+# Description: utility functions for handling XEPs
+# Last Modified: 2014-09-23
+# Based on scripts by:
+#    Tobias Markmann (tm@ayena.de)
+#    Peter Saint-Andre (stpeter@jabber.org)
+# Authors:
+#    Winfried Tilanus (winfried@tilanus.com)
+
+## LICENSE ##
+#
+# Copyright (c) 1999 - 2014 XMPP Standards Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of tqhe Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+## END LICENSE ##
+
+"""
+Runs the XSLT stylesheets on XEPs. Two engines are available:
+ xsltproc (executable binary, debian package xsltproc), the default.
+ lxml (python module, debian package python-lxml), runs in process. Each
+   stylesheet is compiled only once and each XEP is parsed only once for
+   all stylesheets.
+"""
+
+import os
+import copy
+import hashlib
+import StringIO
+import tempfile
+import threading
+import subprocess
+import xeputils.trace
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+ENGINES = ("xsltproc", "lxml")
+
+# The engine in use, see setEngine
+engine = "xsltproc"
+
+# The compiled stylesheets, per full filename: (mtime, XSLT object)
+stylesheets = {}
+
+# The last parsed XEP: (key, tree), see parseXEP
+parsed = (None, None)
+
+
+def setEngine(name):
+    """
+    Selects the XSLT engine, 'xsltproc' or 'lxml'. Falls back to xsltproc
+    when lxml is not available. Returns the name of the engine in use.
+
+    Arguments:
+      name (str):   The name of the engine.
+    """
+    global engine
+    if name not in ENGINES:
+        raise ValueError("Unknown XSLT engine: {}".format(name))
+    if name == "lxml" and etree is None:
+        name = "xsltproc"
+    engine = name
+    return engine
+
+
+def parserOptions():
+    """
+    Returns a lxml parser with the same options xsltproc uses: load the DTD,
+    substitute entities and add default attributes.
+    """
+    return etree.XMLParser(load_dtd=True,
+                           resolve_entities=True,
+                           attribute_defaults=True)
+
+
+def getStylesheet(filename):
+    """
+    Returns the compiled stylesheet, compiles it only when not done before or
+    when it changed since.
+
+    Arguments:
+      filename (str):   Full filename of the stylesheet.
+    """
+    mtime = os.path.getmtime(filename)
+    if filename not in stylesheets or stylesheets[filename][0] != mtime:
+        stylesheets[filename] = (
+            mtime, etree.XSLT(etree.parse(filename, parserOptions())))
+    return stylesheets[filename][1]
+
+
+def parseXEP(xep, xslpath):
+    """
+    Returns the parsed XML tree of the XEP. The tree of the last parsed XEP
+    is kept, so the XHTML and PDF builds of a XEP share one parse when they
+    run one after the other in the same process: in a serial build, or in
+    one job of a parallel build (see AllXEPs.buildParallel).
+
+    Arguments:
+      xep (XEP):        The XEP.
+      xslpath (str):    The path of the DTD and the entities.
+    """
+    global parsed
+    raw = xep.raw
+    key = (xep.filename, xslpath, hashlib.sha1(raw).hexdigest())
+    if parsed[0] != key:
+        # the DTD and entities are referenced relative to the XEP
+        tree = etree.fromstring(raw, parserOptions(),
+                                base_url=os.path.join(xslpath, "xep.xml"))
+        parsed = (key, tree.getroottree())
+    return parsed[1]
+
+
+def transform(name, xep, xslpath, temppath, outfile, store=None):
+    """
+    Runs a stylesheet on a XEP and writes the result to outfile. Returns the
+    errors the XSLT processor reported, if any.
+
+    Arguments:
+      name (str):       The filename of the stylesheet, e.g. 'xep.xsl'.
+      xep (XEP):        The XEP to transform.
+      xslpath (str):    The path of the stylesheets and build dependencies,
+                        used by lxml.
+      temppath (str):   The directory with copies of the stylesheets and
+                        build dependencies, used by xsltproc.
+      outfile (file):   The file to write the result to.
+      store (ImageStore): When given, inline images in the XEP are replaced
+                        by links to the images in this store.
+    """
+    with xeputils.trace.Span("xslt " + name, "xslt", xep) as span:
+        if engine == "lxml":
+            try:
+                tree = parseXEP(xep, xslpath)
+                if store:
+                    with xeputils.trace.Span("images", "images", xep):
+                        tree = copy.deepcopy(tree)
+                        store.rewriteTree(tree)
+                xsl = getStylesheet(os.path.join(xslpath, name))
+                result = xsl(tree)
+                outfile.write(str(result))
+                return "\n".join(str(entry) for entry in xsl.error_log)
+            except etree.Error as e:
+                return str(e)
+        raw = xep.raw
+        if store:
+            with xeputils.trace.Span("images", "images", xep):
+                raw = store.rewrite(raw)
+        p = subprocess.Popen(["xsltproc", os.path.join(temppath, name), "-"],
+                             stdin=subprocess.PIPE,
+                             stdout=outfile,
+                             stderr=subprocess.PIPE,
+                             cwd=temppath)
+        (dummy, error) = p.communicate(raw)
+        span.status(p.returncode)
+        return error
+
+
+def stream(name, xep, xslpath, temppath, consumer):
+    """
+    Runs a stylesheet on a XEP and passes the result as a stream to
+    consumer, without writing it to a file. Returns the errors the XSLT
+    processor reported, if any.
+
+    Arguments:
+      name (str):       The filename of the stylesheet, e.g. 'xep2texml.xsl'.
+      xep (XEP):        The XEP to transform.
+      xslpath (str):    The path of the stylesheets and build dependencies,
+                        used by lxml.
+      temppath (str):   The directory with copies of the stylesheets and
+                        build dependencies, used by xsltproc.
+      consumer (function): Function called with a file like object to read
+                        the result from.
+    """
+    if engine == "lxml":
+        outfile = StringIO.StringIO()
+        error = transform(name, xep, xslpath, temppath, outfile)
+        outfile.seek(0)
+        consumer(outfile)
+        return error
+    # errors go to a file, a full stderr pipe would block xsltproc
+    errfile = tempfile.TemporaryFile(dir=temppath)
+    with xeputils.trace.Span("xslt " + name, "xslt", xep) as span:
+        p = subprocess.Popen(["xsltproc", os.path.join(temppath, name), "-"],
+                             stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=errfile,
+                             cwd=temppath)
+
+        def feed():
+            try:
+                p.stdin.write(xep.raw)
+            except IOError:
+                # xsltproc quit early, its errors tell why
+                pass
+            p.stdin.close()
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        try:
+            consumer(p.stdout)
+        finally:
+            # read what the consumer left, so xsltproc can finish
+            p.stdout.read()
+            p.stdout.close()
+            feeder.join()
+            p.wait()
+        span.status(p.returncode)
+    errfile.seek(0)
+    error = errfile.read()
+    errfile.close()
+    return error